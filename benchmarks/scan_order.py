@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Compare conversion orders: runtime, directory switches, backward inode steps, and
+bytes read from storage during the conversion (Linux /proc/self/io). Each order gets its own copy of the
+dataset so neither benefits from the other's page cache. On a warm cache (freshly
+written dataset) timings mostly show scheduling overhead; run against a real dataset
+after ``sync; echo 3 > /proc/sys/vm/drop_caches`` to see readahead effects.
+Needs bids2nda installed (pip install -e .).
+
+    python benchmarks/scan_order.py [n_subjects] [n_sessions]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import bids2nda
+from bids2nda.schedule import ORDERS
+from bids2nda.testing import make_bids_dataset
+
+
+class StatsHandler(logging.Handler):
+    """keeps the ScheduleStats run() logs"""
+    def __init__(self):
+        super().__init__()
+        self.stats = None
+
+    def emit(self, record):
+        if hasattr(record, "schedule_stats"):
+            self.stats = record.schedule_stats
+
+
+def main(n_subjects: int = 50, n_sessions: int = 2):
+    handler = StatsHandler()
+    logging.getLogger("bids2nda").addHandler(handler)
+    logging.getLogger("bids2nda").setLevel(logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'order':<10} {'scans':>6} {'dir switches':>13} {'back steps':>11} {'MB read':>8} {'seconds':>8}")
+        for order in ORDERS:
+            bids = os.path.join(tmp, f"bids_{order}")
+            guid_map = make_bids_dataset(bids, n_subjects, n_sessions, tasks=("rest", "nback", "faces"))
+            args = bids2nda.parse_args([bids, guid_map, os.path.join(tmp, f"out_{order}"), "--order", order])
+            start = time.perf_counter()
+            imgdf = bids2nda.run(args)
+            seconds = time.perf_counter() - start
+            stats = handler.stats
+            mb_read = f"{stats.read_bytes / 1e6:.1f}" if stats.read_bytes is not None else "n/a"
+            print(f"{order:<10} {imgdf.shape[0]:>6} {stats.directory_switches:>13} "
+                  f"{stats.backward_steps:>11} {mb_read:>8} {seconds:>8.2f}")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
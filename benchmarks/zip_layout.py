@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+Compare metadata zip layouts: file/directory count and conversion time.
+Needs bids2nda installed (pip install -e .).
+
+    python benchmarks/zip_layout.py [n_subjects] [n_sessions]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import bids2nda
+from bids2nda.testing import make_bids_dataset
+
+LAYOUTS = {
+    "per scan (default)": [],
+    "per scan, sharded": ["--shard-output"],
+    "per session": ["--session-zip"],
+    "per session, sharded": ["--session-zip", "--shard-output"],
+}
+
+
+def count_entries(path: str) -> tuple[int, int]:
+    """(files, directories) under path"""
+    n_files = n_dirs = 0
+    for _, dirs, files in os.walk(path):
+        n_files += len(files)
+        n_dirs += len(dirs)
+    return n_files, n_dirs
+
+
+def main(n_subjects: int = 50, n_sessions: int = 2):
+    with tempfile.TemporaryDirectory() as tmp:
+        bids = os.path.join(tmp, "bids")
+        guid_map = make_bids_dataset(bids, n_subjects, n_sessions, tasks=("rest", "nback", "faces"))
+        print(f"{'layout':<24} {'scans':>6} {'files':>6} {'max/dir':>8} {'dirs':>5} {'seconds':>8}")
+        for name, options in LAYOUTS.items():
+            out = os.path.join(tmp, name.replace(" ", "_").replace(",", ""))
+            args = bids2nda.parse_args([bids, guid_map, out] + options)
+            start = time.perf_counter()
+            imgdf = bids2nda.run(args)
+            seconds = time.perf_counter() - start
+            n_files, n_dirs = count_entries(out)
+            max_per_dir = max(len(files) for _, _, files in os.walk(out))
+            print(f"{name:<24} {imgdf.shape[0]:>6} {n_files:>6} {max_per_dir:>8} {n_dirs:>5} {seconds:>8.2f}")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,222 @@
+"""
+Convert from a BIDS dataset archived as one ``.tar`` or ``.zip`` without extracting it.
+
+A member index (name -> offset, size) is built once and cached next to the shadow tree.
+For uncompressed tar, this is one 512-byte header per member. For zip, it is the central directory.
+Then only the bytes the conversion reads are copied out, with random access into the archive,
+into a small local shadow tree under OUTPUT_DIRECTORY:
+  * sidecars, TSVs (participants, sessions, scans, events) and bval/bvec, whole
+  * niftis as header-only stubs: the first vox_offset bytes, re-gzipped
+
+The normal conversion runs on the shadow tree. ``image_file`` is reported as
+``ARCHIVE/member/path`` so rows point into the archive rather than at the stubs.
+Compressed tars (.tar.gz) have no random access and are rejected.
+"""
+import gzip
+import json
+import os
+import shutil
+import struct
+import tarfile
+import zipfile
+import zlib
+
+from .progress import log
+
+SMALL_SUFFIXES = (".json", ".tsv", ".bval", ".bvec")
+NIFTI_SUFFIXES = (".nii.gz", ".nii")
+READ_CHUNK = 64 * 1024
+
+
+def is_archive(path: os.PathLike) -> bool:
+    return os.path.isfile(path) and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+
+def nifti_header_size(prefix: bytes) -> int | None:
+    """Bytes before voxel data (header + extensions) from the start of an uncompressed nifti, None if too short"""
+    if len(prefix) < 4:
+        return None
+    for endian in "<>":
+        sizeof_hdr = struct.unpack(endian + "i", prefix[:4])[0]
+        if sizeof_hdr == 348 and len(prefix) >= 112:  # nifti1: float32 vox_offset at 108
+            return max(int(struct.unpack(endian + "f", prefix[108:112])[0]), 352)
+        if sizeof_hdr == 540 and len(prefix) >= 176:  # nifti2: int64 vox_offset at 168
+            return max(struct.unpack(endian + "q", prefix[168:176])[0], 544)
+        if sizeof_hdr in (348, 540):
+            return None
+    raise ValueError("not a nifti1/nifti2 header")
+
+
+class BidsArchive:
+    """Random access reads of a tar or zip holding one BIDS dataset"""
+
+    def __init__(self, path: os.PathLike, index_file: str | None = None):
+        self.path = os.path.abspath(path)
+        stat = os.stat(self.path)
+        self.key = {"path": self.path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        self._zip = zipfile.ZipFile(self.path) if zipfile.is_zipfile(self.path) else None
+        self._file = None
+        self.shadow_directory: str | None = None  # set by open_archive
+        self.bytes_read = 0  # member bytes read so far (uncompressed for zip members)
+        cached = self._load_index(index_file) if index_file else None
+        self.index_cached = cached is not None
+        if self._zip is not None:
+            # the central directory already is an index. the cache only records that the archive is unchanged
+            self.members = {i.filename: (i.header_offset, i.file_size)
+                            for i in self._zip.infolist() if not i.is_dir()}
+        else:
+            self.members = cached if cached is not None else self._tar_index()
+            self._file = open(self.path, "rb")
+        if index_file and not self.index_cached:
+            self._save_index(index_file)
+        self.root = self._find_root()
+
+    # -- index
+    def _tar_index(self) -> dict[str, tuple[int, int]]:
+        try:
+            tar = tarfile.open(self.path, "r:")
+        except tarfile.ReadError as err:
+            raise ValueError(f"{self.path} is a compressed tar. Random access needs an uncompressed .tar or .zip") from err
+        members = {}
+        with tar:
+            for m in tar:
+                if m.isreg():
+                    members[m.name.removeprefix("./")] = (m.offset_data, m.size)
+                elif m.islnk() and m.linkname.removeprefix("./") in members:
+                    # hard link: data is stored once, with the first name
+                    members[m.name.removeprefix("./")] = members[m.linkname.removeprefix("./")]
+        return members
+
+    def _load_index(self, index_file: str) -> dict[str, tuple[int, int]] | None:
+        if not os.path.exists(index_file):
+            return None
+        with open(index_file) as f:
+            cached = json.load(f)
+        if cached.get("archive") != self.key:
+            return None
+        return {name: tuple(entry) for name, entry in cached["members"].items()}
+
+    def _save_index(self, index_file: str) -> None:
+        os.makedirs(os.path.dirname(index_file) or ".", exist_ok=True)
+        with open(index_file, "w") as f:
+            json.dump({"archive": self.key, "members": self.members}, f)
+
+    def _find_root(self) -> str:
+        """Member prefix of the dataset: directory of the shallowest participants.tsv or sub-* directory"""
+        candidates = []
+        for name in self.members:
+            parts = name.split("/")
+            for depth, part in enumerate(parts[:-1]):
+                if part.startswith("sub-"):
+                    candidates.append((depth, "/".join(parts[:depth])))
+                    break
+            if parts[-1] in ("participants.tsv", "dataset_description.json"):
+                candidates.append((len(parts) - 1, "/".join(parts[:-1])))
+        if not candidates:
+            raise ValueError(f"{self.path} has no sub-* directories or participants.tsv. Not a BIDS archive?")
+        return min(candidates)[1]
+
+    def relative(self, name: str) -> str | None:
+        """``name`` relative to the dataset root, None if outside it"""
+        if not self.root:
+            return name
+        prefix = self.root + "/"
+        return name[len(prefix):] if name.startswith(prefix) else None
+
+    def member_path(self, relative_path: str) -> str:
+        """How a dataset file is reported: ``ARCHIVE/root/relative/path``"""
+        return "/".join(p for p in (self.path, self.root, relative_path) if p)
+
+    def reported_path(self, shadow_file: str) -> str:
+        """``member_path`` of a file in the shadow tree"""
+        return self.member_path(os.path.relpath(shadow_file, self.shadow_directory).replace(os.sep, "/"))
+
+    # -- reads
+    def chunks(self, name: str, chunk_size: int = READ_CHUNK):
+        """Raw bytes of member ``name``, ``chunk_size`` at a time, from its offset"""
+        if self._zip is not None:
+            with self._zip.open(name) as f:
+                while chunk := f.read(chunk_size):
+                    self.bytes_read += len(chunk)
+                    yield chunk
+            return
+        offset, size = self.members[name]
+        self._file.seek(offset)
+        while size > 0:
+            chunk = self._file.read(min(chunk_size, size))
+            if not chunk:
+                raise ValueError(f"{self.path} ends inside member {name}")
+            size -= len(chunk)
+            self.bytes_read += len(chunk)
+            yield chunk
+
+    def read(self, name: str) -> bytes:
+        return b"".join(self.chunks(name))
+
+    def nifti_header(self, name: str) -> bytes:
+        """Uncompressed header + extension bytes of a nifti member, reading only as much as needed"""
+        decompress = zlib.decompressobj(wbits=31) if name.endswith(".gz") else None
+        data = b""
+        for chunk in self.chunks(name, 4096):
+            data += decompress.decompress(chunk) if decompress else chunk
+            size = nifti_header_size(data)
+            if size is not None and len(data) >= size:
+                return data[:size]
+        raise ValueError(f"{self.path}: {name} ends before its nifti header does")
+
+    def close(self) -> None:
+        if self._zip is not None:
+            self._zip.close()
+        if self._file is not None:
+            self._file.close()
+
+    # -- shadow tree
+    def needed_members(self) -> dict[str, str]:
+        """member name -> relative path for everything the conversion reads: top level files and sub-*/"""
+        needed = {}
+        for name in self.members:
+            relative = self.relative(name)
+            if relative is None or not (relative.endswith(SMALL_SUFFIXES) or relative.endswith(NIFTI_SUFFIXES)):
+                continue
+            if "/" in relative and not relative.startswith("sub-"):
+                continue  # derivatives/, sourcedata/, code/, ...
+            needed[name] = relative
+        return needed
+
+    def materialize(self, shadow_directory: str) -> None:
+        """Write small files and nifti header stubs under ``shadow_directory``"""
+        for name, relative in self.needed_members().items():
+            out_file = os.path.join(shadow_directory, *relative.split("/"))
+            os.makedirs(os.path.dirname(out_file), exist_ok=True)
+            if relative.endswith(NIFTI_SUFFIXES):
+                data = self.nifti_header(name)
+                if relative.endswith(".gz"):
+                    data = gzip.compress(data, compresslevel=1, mtime=0)
+            else:
+                data = self.read(name)
+            with open(out_file, "wb") as f:
+                f.write(data)
+
+
+def open_archive(archive_path: os.PathLike, output_directory: os.PathLike) -> tuple[BidsArchive, str]:
+    """
+    Index ``archive_path`` and write its shadow tree to ``OUTPUT_DIRECTORY/.bids_archive/<name>``.
+    Both are reused while the archive's size and mtime are unchanged.
+    Returns the archive and the shadow directory to convert from.
+    """
+    name = os.path.basename(archive_path)
+    shadow = os.path.join(output_directory, ".bids_archive", name)
+    index_file = os.path.join(output_directory, ".bids_archive", name + ".index.json")
+    archive = BidsArchive(archive_path, index_file)
+    archive.shadow_directory = shadow
+    done_file = os.path.join(shadow, ".complete")
+    if archive.index_cached and os.path.exists(done_file):
+        return archive, shadow
+    # archive changed (or last run was interrupted): no stale members
+    shutil.rmtree(shadow, ignore_errors=True)
+    archive.materialize(shadow)
+    log.info(f"read {archive.bytes_read / 1e6:.1f} MB of {archive.key['size'] / 1e6:.1f} MB archive "
+             f"{archive.path} into {shadow}")
+    with open(done_file, "w") as f:
+        json.dump(archive.key, f)
+    return archive, shadow
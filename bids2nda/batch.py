@@ -0,0 +1,162 @@
+"""
+Convert many BIDS datasets in one process tree.
+
+A manifest TSV lists one dataset per row. The GUID mapping and ExperimentID lookup
+are parsed once and handed to every worker instead of once per ``bids2nda`` call.
+
+==> manifest.tsv <==
+bids_directory	output_directory	options
+/data/study1	/nda/study1
+/data/study2	/nda/study2	--session_mapping /data/study2_sessions.tsv --keep-going
+"""
+import os
+import shlex
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from .columnar import write_columnar
+from .experiment_id import read_experiment_lookup
+from .main import MyParser, parse_args, read_guid_mapping, run, write_image03
+from .progress import setup_logging
+
+# lookups shared by all datasets a worker converts. set by _init_worker
+_shared: dict = {}
+
+
+def read_manifest(manifest_file: os.PathLike) -> pd.DataFrame:
+    """
+    Read tab separated manifest with columns bids_directory, output_directory,
+    and optional options (extra ``bids2nda`` command line arguments).
+    """
+    manifest = pd.read_csv(manifest_file, sep="\t", dtype=str, keep_default_na=False)
+    missing = {"bids_directory", "output_directory"} - set(manifest.columns)
+    if missing:
+        raise ValueError(f"batch manifest '{manifest_file}' is missing column(s) {missing}")
+    if "options" not in manifest.columns:
+        manifest["options"] = ""
+    return manifest
+
+
+def _init_worker(guid_mapping: dict, eid_lookup: pd.DataFrame | None):
+    _shared["guid_mapping"] = guid_mapping
+    _shared["eid_lookup"] = eid_lookup
+
+
+def convert_dataset(bids_directory: str, output_directory: str, options: str = "",
+                    keep_rows: bool = False) -> dict:
+    """
+    Run one manifest entry with the worker's shared lookups.
+    Writes ``image03.csv`` to ``output_directory`` and returns throughput stats
+    (and the rows themselves when ``keep_rows`` for a combined csv).
+    """
+    start = time.perf_counter()
+    result = {"bids_directory": bids_directory, "output_directory": output_directory,
+              "rows": 0, "failed": 0, "seconds": 0.0, "error": ""}
+    try:
+        # GUID_MAPPING positional is replaced by the already parsed shared mapping
+        try:
+            args = parse_args([bids_directory, "-", output_directory] + shlex.split(options))
+        except SystemExit as err:
+            # argparse already printed why. fail this row, not the batch
+            raise ValueError(f"invalid options '{options}' (argument parsing exited with {err.code})") from None
+        args.guid_mapping = _shared["guid_mapping"]
+        if args.experimentid_tsv is None:
+            args.experimentid_tsv = _shared["eid_lookup"]
+
+        failures = []
+        image03_df = run(args, failures)
+        write_image03(image03_df, output_directory)
+        if args.format != 'csv':
+            write_columnar(image03_df, output_directory, args.format)
+        result["rows"] = image03_df.shape[0]
+        result["failed"] = len(failures)
+        if keep_rows:
+            result["image03_df"] = image03_df
+    except Exception as err:
+        result["error"] = f"{type(err).__name__}: {err}"
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_batch(manifest: pd.DataFrame, guid_mapping: dict, eid_lookup: pd.DataFrame | None = None,
+              jobs: int = 1, keep_rows: bool = False) -> list[dict]:
+    """
+    Convert every manifest row. ``jobs`` > 1 converts datasets in parallel in a shared process pool.
+    Results are in manifest order.
+    """
+    entries = [(row.bids_directory, row.output_directory, row.options, keep_rows)
+               for row in manifest.itertuples()]
+    if jobs <= 1:
+        _init_worker(guid_mapping, eid_lookup)
+        return [convert_dataset(*entry) for entry in entries]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(guid_mapping, eid_lookup)) as pool:
+        return list(pool.map(convert_dataset, *zip(*entries)))
+
+
+def throughput_report(results: list[dict]) -> pd.DataFrame:
+    """rows/second per dataset"""
+    report = pd.DataFrame([{k: v for k, v in r.items() if k != "image03_df"} for r in results])
+    report["rows_per_sec"] = [round(r / s, 2) if s > 0 else 0 for r, s in zip(report.rows, report.seconds)]
+    report["seconds"] = report.seconds.round(3)
+    return report
+
+
+def parse_batch_args(argv: list[str] | None = None):
+    parser = MyParser(
+        description="Run BIDS to NDA conversion for many datasets listed in a manifest.",
+        fromfile_prefix_chars='@')
+    parser.add_argument(
+        "manifest",
+        help="TSV with columns bids_directory, output_directory, and optional options (extra bids2nda arguments)",
+        metavar="MANIFEST")
+    parser.add_argument(
+        "guid_mapping",
+        help="GUID mapping shared by all datasets",
+        metavar="GUID_MAPPING")
+    parser.add_argument(
+        '--experimentid_tsv',
+        type=str,
+        default=None,
+        help='ExperimentID pattern TSV shared by all datasets (per dataset --experimentid_tsv in options wins)')
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of datasets to convert in parallel')
+    parser.add_argument(
+        '--combined',
+        type=str,
+        default=None,
+        metavar='OUTPUT_DIRECTORY',
+        help='Also write one image03.csv with the rows of every dataset')
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None):
+    args = parse_batch_args(argv)
+    setup_logging()
+    manifest = read_manifest(args.manifest)
+    guid_mapping = read_guid_mapping(args.guid_mapping)
+    eid_lookup = read_experiment_lookup(args.experimentid_tsv) if args.experimentid_tsv else None
+
+    results = run_batch(manifest, guid_mapping, eid_lookup, args.jobs, keep_rows=args.combined is not None)
+
+    report = throughput_report(results)
+    print(report.to_string(index=False))
+
+    if args.combined is not None:
+        combined = pd.concat([r["image03_df"] for r in results if "image03_df" in r], ignore_index=True)
+        write_image03(combined, args.combined)
+
+    if (report.error != "").any() or (report.failed > 0).any():
+        print(f"Batch incomplete: {(report.error != '').sum()} datasets errored, {report.failed.sum()} files failed.")
+        sys.exit(1)
+    print("Batch metadata extraction complete.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Checksums for the ``manifest`` image03 column (``--checksum md5|sha256``).
+
+Every file a row uploads (nifti, metadata zip, bvec/bval, thumbnail) is hashed in large chunks
+on a thread pool (hashlib releases the GIL while hashing). Digests are cached by
+path, size, and mtime in ``OUTPUT_DIRECTORY/checksums.tsv`` so unchanged files are
+not read again on the next run. Each row gets a ``<scan>.manifest.json`` listing its files.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from .metadata_zip import metadata_zip_path
+from .progress import log
+
+CHUNK_SIZE = 8 * 1024 * 1024
+MANIFEST_COLUMNS = ["image_file", "data_file2", "bvecfile", "bvalfile", "image_thumbnail_file"]
+
+FileKey = tuple[str, int, int]  # path, size, mtime_ns
+
+
+def file_key(path: str) -> FileKey:
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+
+def file_digest(path: str, algorithm: str = "md5", chunk_size: int = CHUNK_SIZE) -> str:
+    """Hex digest of ``path`` read ``chunk_size`` bytes at a time"""
+    h = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ChecksumCache:
+    """Digests keyed by (path, size, mtime_ns) and algorithm, stored as a TSV"""
+
+    def __init__(self, cache_file: str | None = None):
+        self.cache_file = cache_file
+        self.digests: dict[tuple[FileKey, str], str] = {}
+        self.hits = 0
+        self.misses = 0
+        if cache_file and os.path.exists(cache_file):
+            cached = pd.read_csv(cache_file, sep="\t", dtype={"digest": str})
+            for row in cached.itertuples():
+                self.digests[((row.path, int(row.size), int(row.mtime_ns)), row.algorithm)] = row.digest
+
+    def get(self, key: FileKey, algorithm: str) -> str | None:
+        digest = self.digests.get((key, algorithm))
+        if digest is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return digest
+
+    def set(self, key: FileKey, algorithm: str, digest: str) -> None:
+        self.digests[(key, algorithm)] = digest
+
+    def save(self) -> None:
+        if not self.cache_file:
+            return
+        with open(self.cache_file, "w") as f:
+            f.write("path\tsize\tmtime_ns\talgorithm\tdigest\n")
+            for ((path, size, mtime_ns), algorithm), digest in self.digests.items():
+                f.write(f"{path}\t{size}\t{mtime_ns}\t{algorithm}\t{digest}\n")
+
+
+def _digest_or_error(path: str, algorithm: str) -> str | OSError:
+    try:
+        return file_digest(path, algorithm)
+    except OSError as err:
+        return err
+
+
+def checksum_files(paths: list[str], algorithm: str = "md5", jobs: int = 1,
+                   cache: ChecksumCache | None = None,
+                   errors: dict[str, OSError] | None = None) -> dict[str, tuple[int, str]]:
+    """
+    ``path -> (size, digest)`` for every path.
+    Only files not in ``cache`` (or changed since) are read, ``jobs`` at a time.
+    With ``errors``, a file that cannot be read is added to it as (path -> error) and left out
+    instead of stopping the rest.
+    """
+    if cache is None:
+        cache = ChecksumCache()
+    keys = {}
+    for path in dict.fromkeys(paths):
+        try:
+            keys[path] = file_key(path)
+        except OSError as err:
+            if errors is None:
+                raise
+            errors[path] = err
+    todo = [path for path, key in keys.items() if cache.get(key, algorithm) is None]
+    digest = file_digest if errors is None else _digest_or_error
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        for path, result in zip(todo, pool.map(lambda p: digest(p, algorithm), todo)):
+            if isinstance(result, OSError):
+                errors[path] = result
+                del keys[path]
+            else:
+                cache.set(keys[path], algorithm, result)
+    log.info(f"checksums: {len(todo)} files hashed, {len(keys) - len(todo)} unchanged from cache")
+    return {path: (key[1], cache.digests[(key, algorithm)]) for path, key in keys.items()}
+
+
+def manifest_path(output_directory: os.PathLike, file: str, shard: bool = False) -> str:
+    """``<scan>.manifest.json`` next to where the scan's metadata zip goes"""
+    return metadata_zip_path(output_directory, file, shard=shard).replace(".metadata.zip", ".manifest.json")
+
+
+def add_manifests(image03_df: pd.DataFrame, output_directory: os.PathLike, algorithm: str = "md5",
+                  jobs: int = 1, shard: bool = False,
+                  errors: dict[str, OSError] | None = None) -> pd.DataFrame:
+    """
+    Hash each row's files, write its manifest json, and set the ``manifest`` column to that path.
+    With ``errors``, a row with a file that cannot be read is added to it as (image_file -> error)
+    and gets no manifest instead of stopping the rest.
+    """
+    if image03_df.shape[0] == 0:
+        return image03_df
+    os.makedirs(output_directory, exist_ok=True)
+    row_files = [[f for f in (row[col] for col in MANIFEST_COLUMNS if col in row) if f]
+                 for row in image03_df.to_dict("records")]
+    cache = ChecksumCache(os.path.join(output_directory, "checksums.tsv"))
+    file_errors = None if errors is None else {}
+    digests = checksum_files([f for files in row_files for f in files], algorithm, jobs, cache, file_errors)
+    cache.save()
+
+    manifests = []
+    for image_file, files in zip(image03_df.image_file, row_files):
+        if failed := [file_errors[f] for f in files if f in (file_errors or {})]:
+            errors[image_file] = failed[0]
+            manifests.append("")
+            continue
+        out_file = manifest_path(output_directory, image_file, shard)
+        os.makedirs(os.path.dirname(out_file) or ".", exist_ok=True)
+        entries = [{"path": os.path.abspath(f), "name": os.path.basename(f),
+                    "size": digests[f][0], f"{algorithm}sum": digests[f][1]} for f in files]
+        with open(out_file, "w") as f:
+            json.dump({"files": entries}, f, indent=2)
+        manifests.append(out_file)
+    image03_df = image03_df.copy()
+    image03_df["manifest"] = manifests
+    return image03_df
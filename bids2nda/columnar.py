@@ -0,0 +1,75 @@
+"""
+Columnar (parquet/feather) copy of the image03 table.
+
+The NDA ``image03.csv`` quotes every value as a string.
+Dashboards and joins are happier with typed columns they can load selectively,
+so the same rows can also be written with numeric dtypes.
+Requires the optional ``pyarrow`` dependency (``pip install bids2nda[columnar]``).
+"""
+import os
+
+import pandas as pd
+
+COLUMNAR_FORMATS = {"parquet": ".parquet", "feather": ".feather", "arrow": ".arrow"}
+
+# columns that are numbers in image03 but stored as "" when not applicable
+NUMERIC_COLUMNS = [
+    "interview_age",
+    "image_num_dimensions",
+    "image_extent1",
+    "image_extent2",
+    "image_extent3",
+    "image_extent4",
+    "image_resolution1",
+    "image_resolution2",
+    "image_resolution3",
+    "image_resolution4",
+    "image_slice_thickness",
+    "mri_repetition_time_pd",
+    "mri_echo_time_pd",
+    "magnetic_field_strength",
+    "flip_angle",
+]
+
+# integer valued columns that can still be missing (extent4 for 3D images)
+INTEGER_COLUMNS = {"interview_age", "image_num_dimensions",
+                   "image_extent1", "image_extent2", "image_extent3", "image_extent4"}
+
+
+def typed_image03(image03_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Copy of ``image03_df`` with numeric columns converted.
+    Empty strings become missing values. The input is not modified
+    so the NDA csv can still be written from it unchanged.
+    """
+    typed = image03_df.copy()
+    for col in typed.columns:
+        if col in NUMERIC_COLUMNS:
+            values = pd.to_numeric(typed[col], errors="coerce")  # "" -> NaN
+            typed[col] = values.astype("Int64" if col in INTEGER_COLUMNS else "float64")
+        else:
+            # everything else is text. sidecar values (slice_timing list, numeric ExperimentID)
+            # would otherwise make mixed-type columns arrow cannot store
+            typed[col] = [x if isinstance(x, str) else str(x) for x in typed[col]]
+    return typed
+
+
+def write_columnar(image03_df: pd.DataFrame, output_directory: os.PathLike, fmt: str) -> str:
+    """
+    Write typed image03 rows as ``image03.<fmt>`` in ``output_directory``.
+    Returns path of written file.
+    """
+    if fmt not in COLUMNAR_FORMATS:
+        raise ValueError(f"unknown columnar format '{fmt}'. Use one of {list(COLUMNAR_FORMATS)}")
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as err:
+        raise ImportError(f"--format {fmt} requires pyarrow (pip install pyarrow)") from err
+
+    out_file = os.path.join(output_directory, "image03" + COLUMNAR_FORMATS[fmt])
+    typed = typed_image03(image03_df)
+    if fmt == "parquet":
+        typed.to_parquet(out_file, index=False)
+    else:
+        typed.reset_index(drop=True).to_feather(out_file)
+    return out_file
@@ -0,0 +1,112 @@
+"""
+Compare new image03 rows against a previously generated (and uploaded) ``image03.csv``.
+Only rows that are new or changed need to be uploaded again.
+
+Rows are keyed by ``image_file`` and compared by a digest of the row as it is written to csv.
+The previous file is streamed so only one ``image_file -> digest`` dict is kept in memory.
+"""
+import csv
+import hashlib
+import io
+import os
+
+import pandas as pd
+
+from .progress import log
+
+Digest = bytes
+
+# filled in after the delta, only for the rows it selects (--checksum, --thumbnails). empty in the rows being compared
+NOT_COMPARED = ("manifest", "image_thumbnail_file")
+
+
+def row_digest(header: list[str], fields: list[str]) -> Digest:
+    """
+    Hash csv text values of a row.
+    ``data_file2`` is reduced to the zip's basename so a different OUTPUT_DIRECTORY
+    does not make every row look changed. :py:data:`NOT_COMPARED` columns are skipped.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for col, val in zip(header, fields):
+        if col in NOT_COMPARED:
+            continue
+        if col == "data_file2":
+            val = os.path.basename(val)
+        h.update(col.encode())
+        h.update(b"\0")
+        h.update(val.encode())
+        h.update(b"\0")
+    return h.digest()
+
+
+def _iter_digests(reader):
+    """yield (image_file, digest) for csv rows after the header line"""
+    header = next(reader)
+    if "image_file" not in header:
+        raise ValueError(f"image03 header is missing 'image_file' column: {header}")
+    key_i = header.index("image_file")
+    for fields in reader:
+        if fields:
+            yield fields[key_i], row_digest(header, fields)
+
+
+def read_previous_digests(image03_csv: os.PathLike) -> dict[str, Digest]:
+    """
+    Stream previous ``image03.csv`` (with ``"image","3"`` first line) into ``image_file -> digest``.
+    """
+    with open(image03_csv, newline="") as fp:
+        reader = csv.reader(fp)
+        first = next(reader)
+        if first != ["image", "3"]:
+            raise ValueError(f"{image03_csv} does not start with '\"image\",\"3\"' line. Not an image03 file?")
+        return dict(_iter_digests(reader))
+
+
+def current_digests(image03_df: pd.DataFrame) -> list[Digest]:
+    """
+    Digest for each row of ``image03_df`` in order.
+    Rows are serialized with the same ``to_csv`` call as the final output so values compare as text.
+    """
+    buf = io.StringIO(image03_df.to_csv(sep=",", index=False, quoting=csv.QUOTE_ALL))
+    return [digest for _, digest in _iter_digests(csv.reader(buf))]
+
+
+def select_delta(image03_df: pd.DataFrame, previous: dict[str, Digest]) -> tuple[pd.DataFrame, dict[str, list[str]]]:
+    """
+    Keep only rows not in ``previous`` or with a different digest.
+    Returns the subset and ``{'added': [...], 'changed': [...], 'removed': [...]}`` image_file lists.
+    """
+    summary: dict[str, list[str]] = {"added": [], "changed": [], "removed": []}
+    if image03_df.shape[0] == 0:
+        summary["removed"] = list(previous)
+        return image03_df, summary
+    keep = []
+    seen = set()
+    for image_file, digest in zip(image03_df.image_file, current_digests(image03_df)):
+        seen.add(image_file)
+        prev = previous.get(image_file)
+        if prev is None:
+            summary["added"].append(image_file)
+            keep.append(True)
+        elif prev != digest:
+            summary["changed"].append(image_file)
+            keep.append(True)
+        else:
+            keep.append(False)
+    summary["removed"] = [f for f in previous if f not in seen]
+    return image03_df[keep].reset_index(drop=True), summary
+
+
+def write_delta_summary(summary: dict[str, list[str]], output_directory: os.PathLike) -> str:
+    """
+    Write ``image03_delta.tsv`` (status, image_file) and print counts.
+    """
+    out_file = os.path.join(output_directory, "image03_delta.tsv")
+    with open(out_file, "w") as fp:
+        fp.write("status\timage_file\n")
+        for status, files in summary.items():
+            for f in files:
+                fp.write(f"{status}\t{f}\n")
+    log.info("delta vs previous image03: " +
+          ", ".join(f"{len(files)} {status}" for status, files in summary.items()))
+    return out_file
@@ -0,0 +1,106 @@
+"""
+b-value/b-vector analysis for dwi rows: single- vs multi-shell ``scan_type`` and gradient sanity checks.
+
+Gradient files are parsed with numpy once per (path, mtime) -- an inherited top level
+``dwi.bval`` shared by every scan is read and analysed a single time. Per scan only the
+volume count from the already loaded nifti header is compared.
+"""
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+B0_THRESHOLD = 50  # s/mm^2. at or below is a b=0 volume
+SHELL_GAP = 100  # s/mm^2. sorted b-values further apart than this start a new shell
+DIRECTION_DECIMALS = 2  # unit vectors equal to this many decimals are the same direction
+
+
+@dataclass(frozen=True)
+class GradientInfo:
+    n_volumes: int  # entries in bval (and bvec)
+    n_b0: int
+    shells: tuple[int, ...]  # mean b-value of each non-b0 shell, ascending
+    n_directions: int  # unique non-b0 directions (v and -v counted once)
+    problems: tuple[str, ...]
+
+    @property
+    def scan_type(self) -> str | None:
+        """image03 scan_type, None if there are no diffusion weighted volumes or the files are inconsistent"""
+        if self.problems or not self.shells:
+            return None
+        return "single-shell DTI" if len(self.shells) == 1 else "multi-shell DTI"
+
+    def check_volumes(self, n_volumes: int) -> list[str]:
+        """Problems plus a mismatch with the nifti's 4th dimension"""
+        problems = list(self.problems)
+        if n_volumes != self.n_volumes:
+            problems.append(f"{self.n_volumes} gradients but nifti has {n_volumes} volumes")
+        return problems
+
+
+@lru_cache(maxsize=1024)
+def _load(path: str, mtime_ns: int) -> np.ndarray:
+    values = np.loadtxt(path, ndmin=2)
+    values.setflags(write=False)  # shared through the cache
+    return values
+
+
+def load_gradient_file(path: str) -> np.ndarray:
+    """bval (1 x N) or bvec (3 x N) as a 2D array, cached until the file changes"""
+    return _load(os.path.abspath(path), os.stat(path).st_mtime_ns)
+
+
+def cluster_shells(bvals: np.ndarray) -> np.ndarray:
+    """Mean b-value of each shell: non-b0 values split wherever sorted neighbours differ by > SHELL_GAP"""
+    weighted = np.sort(bvals[bvals > B0_THRESHOLD])
+    if weighted.size == 0:
+        return np.array([])
+    starts = np.flatnonzero(np.r_[True, np.diff(weighted) > SHELL_GAP])
+    counts = np.diff(np.r_[starts, weighted.size])
+    return np.add.reduceat(weighted, starts) / counts
+
+
+def count_directions(bvecs: np.ndarray) -> int:
+    """Unique directions among (N x 3) unit vectors, with v and -v the same direction"""
+    if bvecs.shape[0] == 0:
+        return 0
+    norms = np.linalg.norm(bvecs, axis=1, keepdims=True)
+    unit = bvecs / np.where(norms == 0, 1, norms)
+    # flip so the largest magnitude component is positive
+    largest = unit[np.arange(unit.shape[0]), np.abs(unit).argmax(axis=1)]
+    unit = unit * np.where(largest < 0, -1, 1)[:, None]
+    return np.unique(np.round(unit, DIRECTION_DECIMALS) + 0.0, axis=0).shape[0]
+
+
+@lru_cache(maxsize=1024)
+def _analyze(bval_key: tuple[str, int], bvec_key: tuple[str, int]) -> GradientInfo:
+    bvals = _load(*bval_key).ravel()
+    bvecs = _load(*bvec_key)
+    problems = []
+    if bvecs.shape[0] != 3 and bvecs.shape[1] == 3:
+        problems.append(f"bvec is {bvecs.shape[0]} x 3, BIDS wants 3 rows")
+        bvecs = bvecs.T
+    elif bvecs.shape[0] != 3:
+        problems.append(f"bvec has {bvecs.shape[0]} rows, expected 3")
+    if bvecs.shape[1] != bvals.size:
+        problems.append(f"{bvals.size} b-values but {bvecs.shape[1]} b-vectors")
+
+    weighted = bvals > B0_THRESHOLD
+    n = min(bvals.size, bvecs.shape[1])
+    vectors = bvecs[:3, :n].T[weighted[:n]]
+    norms = np.linalg.norm(vectors, axis=1)
+    if np.any(np.abs(norms - 1) > 0.1):
+        problems.append(f"{int(np.sum(np.abs(norms - 1) > 0.1))} diffusion weighted b-vectors are not unit length")
+
+    return GradientInfo(n_volumes=int(bvals.size),
+                        n_b0=int(np.sum(~weighted)),
+                        shells=tuple(int(round(b)) for b in cluster_shells(bvals)),
+                        n_directions=count_directions(vectors),
+                        problems=tuple(problems))
+
+
+def analyze_gradients(bval_file: str, bvec_file: str) -> GradientInfo:
+    """Shells, directions, and consistency problems for a bval/bvec pair. Cached until either file changes"""
+    keys = [(os.path.abspath(f), os.stat(f).st_mtime_ns) for f in (bval_file, bvec_file)]
+    return _analyze(*keys)
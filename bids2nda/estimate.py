@@ -0,0 +1,166 @@
+"""
+Estimate a conversion's runtime and output size before running it (``--estimate``).
+
+The conversion stages (session context, sidecar merge, header read, metadata zip) run
+serially on a stratified random sample of scans, with zips written to a temporary directory.
+Each stage's cost is scaled to the whole dataset. The runtime assumes the run's
+``--stage-workers``: stages overlap, so the slowest stage (time / its workers) sets the pace.
+"""
+import copy
+import os
+import random
+import tempfile
+import time
+from collections import OrderedDict, defaultdict
+
+import pandas as pd
+
+from .archive import is_archive
+from .main import CONVERT_STAGES, find_niftis, get_metadata_for_nifti, image03_row, read_guid_mapping
+from .metadata_zip import MetadataZips
+from .progress import WarningTally, log
+from .session_info import group_by_session, read_participant_info, session_context
+
+
+def scan_suffix(file: str) -> str:
+    return file.split("_")[-1].split(".")[0]
+
+
+def stratified_sample(files: list[str], n: int, seed: int = 0) -> list[str]:
+    """
+    Up to ``n`` files spread across (suffix, subject) strata.
+    Strata are visited round-robin so every suffix and subject is represented before any repeats.
+    """
+    rng = random.Random(seed)
+    strata = defaultdict(list)
+    for file in files:
+        strata[(scan_suffix(file), os.path.basename(file).split("_")[0])].append(file)
+    # round-robin over suffixes first so rare suffixes (e.g. dwi) are not crowded out by subjects
+    by_suffix = defaultdict(list)
+    for (suffix, _), members in sorted(strata.items()):
+        rng.shuffle(members)
+        by_suffix[suffix].append(members)
+    for groups in by_suffix.values():
+        rng.shuffle(groups)
+
+    sample = []
+    while len(sample) < min(n, len(files)):
+        for groups in by_suffix.values():
+            # next non-empty subject group for this suffix
+            while groups and not groups[0]:
+                groups.pop(0)
+            if not groups:
+                continue
+            sample.append(groups[0].pop())
+            groups.append(groups.pop(0))
+            if len(sample) == n:
+                break
+    return sample
+
+
+def estimate(args, sample_size: int = 50, seed: int = 0) -> dict:
+    """
+    Convert a sample of ``args.bids_directory`` and extrapolate to all files.
+    Returns dict with counts, expected seconds (with ``args.stage_workers``) and serial seconds,
+    per stage seconds, output bytes, metadata zip count, and per category warning and error rates.
+    """
+    if is_archive(args.bids_directory):
+        raise ValueError(f"{args.bids_directory} is an archive. --estimate needs an extracted BIDS_DIRECTORY "
+                         "(a conversion can read the archive directly)")
+    start = time.perf_counter()
+    guid_mapping = args.guid_mapping if isinstance(args.guid_mapping, dict) \
+        else read_guid_mapping(args.guid_mapping)
+    participants_df = read_participant_info(args.bids_directory, args.session_mapping)
+    files = find_niftis(args.bids_directory)
+    setup_seconds = time.perf_counter() - start
+
+    sessions = group_by_session(files)
+    sample = stratified_sample(files, sample_size, seed)
+    sampled_sessions = group_by_session(sample)
+
+    session_seconds = []
+    file_seconds = defaultdict(float)  # stage -> seconds over the sampled files
+    zip_bytes = 0
+    n_errors = 0
+    rows = OrderedDict()
+    with tempfile.TemporaryDirectory() as tmpdir, WarningTally() as tally:
+        sample_args = copy.copy(args)
+        sample_args.output_directory = tmpdir
+        zips = MetadataZips(args.bids_directory, tmpdir)
+        json_cache = {}
+        for (sub, ses), session_files in sampled_sessions.items():
+            t0 = time.perf_counter()
+            try:
+                session = session_context(args.bids_directory, participants_df, guid_mapping, sub, ses)
+            except Exception as err:
+                log.debug(f"estimate: session sub-{sub} ses-{ses} failed: {err}")
+                n_errors += len(session_files)
+                continue
+            session_seconds.append(time.perf_counter() - t0)
+            for file in session_files:
+                stage = "metadata"
+                t0 = time.perf_counter()
+                try:
+                    metadata = get_metadata_for_nifti(args.bids_directory, file, json_cache)
+                    file_seconds[stage] += time.perf_counter() - t0
+                    stage, t0 = "header", time.perf_counter()
+                    row = image03_row(sample_args, session, file, write_zip=False, zips=zips, metadata=metadata)
+                    file_seconds[stage] += time.perf_counter() - t0
+                    stage, t0 = "zip", time.perf_counter()
+                    if row['data_file2']:
+                        zips.add(file, metadata)
+                except Exception as err:
+                    log.debug(f"estimate: {file} failed in {stage}: {err}")
+                    n_errors += 1
+                    continue
+                finally:
+                    file_seconds[stage] += time.perf_counter() - t0
+                for key, value in row.items():
+                    rows.setdefault(key, []).append(value)
+        zips.close()
+        for path in zips.written:
+            zip_bytes += os.path.getsize(path)
+        n_zips_sampled = len(zips.written)
+
+    n_sampled = len(sample)
+    n_total = len(files)
+    scale = n_total / n_sampled if n_sampled else 0
+    sample_df = pd.DataFrame(rows)
+    csv_bytes_per_row = len(sample_df.to_csv(index=False).encode()) / max(sample_df.shape[0], 1)
+    mean_session = sum(session_seconds) / len(session_seconds) if session_seconds else 0
+    stage_seconds = {"session": mean_session * len(sessions)}
+    stage_seconds.update({stage: file_seconds[stage] * scale for stage in CONVERT_STAGES[1:]})
+    workers = {stage: 1 for stage in CONVERT_STAGES}
+    workers.update(dict(getattr(args, 'stage_workers', None) or []))
+    pipelined_seconds = max(stage_seconds[stage] / workers[stage] for stage in CONVERT_STAGES)
+
+    # sample zips are one per scan. --session-zip makes (at most) one per session
+    n_zips = round(n_zips_sampled * scale)
+    if getattr(args, 'session_zip', False):
+        n_zips = min(n_zips, len(sessions))
+    return {
+        "files": n_total,
+        "sessions": len(sessions),
+        "sampled": n_sampled,
+        "stage_workers": workers,
+        "seconds": round(setup_seconds + pipelined_seconds, 3),
+        "serial_seconds": round(setup_seconds + sum(stage_seconds.values()), 3),
+        "stage_seconds": {stage: round(seconds, 3) for stage, seconds in stage_seconds.items()},
+        "seconds_per_file": round(sum(file_seconds.values()) / n_sampled, 4) if n_sampled else 0,
+        "metadata_zips": n_zips,
+        "output_bytes": round(zip_bytes * scale + csv_bytes_per_row * n_total),
+        "error_rate": round(n_errors / n_sampled, 3) if n_sampled else 0,
+        "warning_rates": {category: round(count / n_sampled, 3) for category, count in tally.counts().items()},
+    }
+
+
+def log_estimate(report: dict) -> None:
+    log.info(f"estimate from {report['sampled']} of {report['files']} files ({report['sessions']} sessions):")
+    workers = ", ".join(f"{stage}={n}" for stage, n in report["stage_workers"].items())
+    log.info(f"  runtime with stage workers {workers}: {report['seconds']} s "
+             f"(serial {report['serial_seconds']} s, {report['seconds_per_file']} s/file)")
+    log.info("  stage seconds: " + ", ".join(f"{stage} {seconds} s" for stage, seconds in report["stage_seconds"].items()))
+    log.info(f"  output: {report['output_bytes'] / 1e6:.2f} MB, {report['metadata_zips']} metadata zips")
+    log.info(f"  error rate: {report['error_rate']:.1%}")
+    for category, rate in report["warning_rates"].items():
+        log.info(f"  {category} warning rate: {rate:.1%}")
@@ -0,0 +1,59 @@
+"""
+Record scans that could not be converted (``--keep-going``)
+and read them back to reprocess only those (``--only-files``).
+"""
+import csv
+import os
+
+Failure = tuple[str, Exception]  # (nifti path, reason)
+
+
+def write_failures(failures: list[Failure], output_directory: os.PathLike) -> str:
+    """
+    Write ``image03_errors.tsv`` with columns file, error_type, and error.
+    The file can be given back to ``--only-files``.
+    """
+    out_file = errors_path(output_directory)
+    with open(out_file, "w") as fp:
+        fp.write("file\terror_type\terror\n")
+        for file, err in failures:
+            # keep one line per failure. absolute so a rerun from another directory matches
+            reason = str(err).replace("\t", " ").replace("\n", " ")
+            fp.write(f"{os.path.abspath(file)}\t{type(err).__name__}\t{reason}\n")
+    return out_file
+
+
+def errors_path(output_directory: os.PathLike) -> str:
+    return os.path.join(output_directory, "image03_errors.tsv")
+
+
+def remove_failures(output_directory: os.PathLike) -> None:
+    """Remove a previous run's ``image03_errors.tsv`` after a run without failures"""
+    if os.path.exists(errors_path(output_directory)):
+        os.remove(errors_path(output_directory))
+
+
+def rows_not_rerun(output_directory: os.PathLike, only: set[str]) -> list[str]:
+    """
+    ``image_file`` of rows in an existing ``OUTPUT_DIRECTORY/image03.csv`` that are not in ``only``.
+    An ``--only-files`` run writing there would drop them.
+    """
+    csv_file = os.path.join(output_directory, "image03.csv")
+    if not os.path.exists(csv_file):
+        return []
+    with open(csv_file, newline="") as fp:
+        next(fp, None)  # "image","3"
+        return [row["image_file"] for row in csv.DictReader(fp)
+                if os.path.abspath(row.get("image_file") or "") not in only]
+
+
+def read_only_files(list_file: os.PathLike) -> set[str]:
+    """
+    Absolute paths to reprocess.
+    ``list_file`` is either one path per line or an ``image03_errors.tsv`` (first column used).
+    """
+    with open(list_file) as fp:
+        lines = [line.rstrip("\n") for line in fp if line.strip()]
+    if lines and lines[0].startswith("file\terror"):
+        lines = lines[1:]
+    return {os.path.abspath(line.split("\t")[0]) for line in lines}
@@ -2,10 +2,11 @@
 
 from __future__ import print_function
 import argparse
+import copy
 import csv
 import logging
-import zipfile
 from collections import OrderedDict
+from contextlib import closing, nullcontext
 from glob import glob
 import os
 import sys
@@ -16,8 +17,22 @@ import pandas as pd
 import numpy as np
 
 
+from .archive import is_archive, open_archive
+from .checksum import add_manifests
+from .columnar import COLUMNAR_FORMATS, write_columnar
+from .delta import read_previous_digests, select_delta, write_delta_summary
+from .diffusion import analyze_gradients
 from .experiment_id import read_experiment_lookup, eid_of_filename
-from .session_info import read_participant_info, read_scan_date, read_session_mapping
+from .failures import read_only_files, remove_failures, rows_not_rerun, write_failures
+from .integrity import LEVELS as INTEGRITY_LEVELS, CorruptFileError, check_integrity
+from .memory import MemoryTracker
+from .metadata_zip import MetadataZips
+from .pipeline import Pipeline, Stage, StageError
+from .progress import Progress, WarningTally, log, setup_logging, warn
+from .schedule import ORDERS, ScheduleStats, schedule
+from .session_info import (SessionContext, ndar_date, read_participant_info,
+                           read_session_mapping, session_context)
+from .thumbnail import make_thumbnails
 
 
 def get_potential_jsons(bids_root: os.PathLike, sidecarJSON: os.PathLike) -> list[os.PathLike]:
@@ -78,10 +93,22 @@ def get_potential_jsons(bids_root: os.PathLike, sidecarJSON: os.PathLike) -> lis
     potentialJSONs.append(sidecarJSON)
     return potentialJSONs
 
-def get_metadata_for_nifti(bids_root: str, path: str) -> dict:
+def read_json(json_file_path: os.PathLike) -> dict | None:
+    """Parse json file. None if it does not exist"""
+    if not os.path.exists(json_file_path):
+        return None
+    with open(json_file_path, "r") as f:
+        return json.load(f)
+
+
+def get_metadata_for_nifti(bids_root: str, path: str, json_cache: dict | None = None) -> dict:
     """
     Find and read all json files that might have relevant metadata for input file.
     Also pull metadata from filename components.
+
+    ``json_cache`` (path -> dict or None if missing) is shared across calls so inherited
+    sidecars like bids/task-rest_bold.json are checked and parsed once per run, not once per scan.
+    The file's own sidecar is always read.
     """
 
     #TODO support .nii
@@ -96,8 +123,13 @@ def get_metadata_for_nifti(bids_root: str, path: str) -> dict:
             if  len(kv_arr := kv.split("-")) == 2 }
  
     for json_file_path in potentialJSONs:
-        if os.path.exists(json_file_path):
-            param_dict = json.load(open(json_file_path, "r"))
+        if json_cache is not None and json_file_path != sidecarJSON:
+            if json_file_path not in json_cache:
+                json_cache[json_file_path] = read_json(json_file_path)
+            param_dict = json_cache[json_file_path]
+        else:
+            param_dict = read_json(json_file_path)
+        if param_dict is not None:
             merged_param_dict.update(param_dict)
 
     return merged_param_dict
@@ -159,344 +191,513 @@ def cosine_to_orientation(iop):
         )
 
 
-def run(args) -> pd.DataFrame:
-
-    guid_mapping = dict([line.split(" - ") for line in open(args.guid_mapping).read().split("\n") if line != ''])
-
-    suffix_to_scan_type = {"dwi": "MR diffusion",
-                           "bold": "fMRI",
-                           "sbref": "fMRI",
-                           #""MR structural(MPRAGE)",
-                           "T1w": "MR structural (T1)",
-                           "UNIT1": "MR structural (MP2RAGE)",
-                           "PD": "MR structural (PD)",
-                           #"MR structural(FSPGR)",
-                           "T2w": "MR structural (T2)",
-                           "inplaneT2": "MR structural (T2)",
-                           "FLAIR": "FLAIR",
-                           "FLASH": "MR structural (FLASH)",
-                           #PET;
-                            #ASL;
-                            #microscopy;
-                            #MR structural(PD, T2);
-                            #MR structural(B0 map);
-                            #MR structural(B1 map);
-                            #single - shell DTI;
-                            #multi - shell DTI;
-                           "epi": "Field Map",
-                           "phase1": "Field Map",
-                           "phase2": "Field Map",
-                           "phasediff": "Field Map",
-                           "magnitude1": "Field Map",
-                           "magnitude2": "Field Map",
-                           "fieldmap": "Field Map"
-                           #X - Ray
-                           }
-
-    # nibabel.data_dir / "standard.nii.gz" reports "unknown" xyzt unit types
-    units_dict = {"mm": "Millimeters",
-                  "sec": "Seconds",
-                  "msec": "Milliseconds",
-                  "unknown": "Unknown"}
-
-    participants_df = read_participant_info(args.bids_directory, args.session_mapping)
-
-    image03_dict = OrderedDict()
-    for file in glob(os.path.join(args.bids_directory, "sub-*", "*", "sub-*.nii.gz")) + \
-            glob(os.path.join(args.bids_directory, "sub-*", "ses-*", "*", "sub-*_ses-*.nii.gz")):
-
-        metadata = get_metadata_for_nifti(args.bids_directory, file)
-
-        bids_subject_id = os.path.split(file)[-1].split("_")[0][4:]
-        dict_append(image03_dict, 'subjectkey', guid_mapping[bids_subject_id])
-        dict_append(image03_dict, 'src_subject_id', bids_subject_id)
-
-        sub = file.split("sub-")[-1].split("_")[0]
-        date = None  # initialization. set by sessions.tsv or _scans.tsv
-        if "ses-" in file:
-            ses = file.split("ses-")[-1].split("_")[0]
-            scans_file = (os.path.join(args.bids_directory, "sub-" + sub, "ses-" + ses, "sub-" + sub + "_ses-" + ses + "_scans.tsv"))
-
-            this_subj = participants_df[participants_df.participant_id == "sub-" + sub]
-            this_subj = this_subj[this_subj.session_id == 'ses-' + ses]
-            if this_subj.shape[0] == 0:
-                raise Exception(f"{args.bids_directory}/sub-{sub}/sub-{ses}_sessions.tsv must have row with session_id = ses-{ses}")
-            if 'acq_time' in this_subj.columns:
-                date = this_subj.acq_time.tolist()[0]
-        else:
-            ses = None
-            scans_file = (os.path.join(args.bids_directory, "sub-" + sub, "sub-" + sub + "_scans.tsv"))
-
-            this_subj = participants_df[participants_df.participant_id == "sub-" + sub]
-            if this_subj.shape[0] == 0:
-                raise Exception(f"{args.bids_directory}/participants.tsv must have row with participant_id = 'sub-{sub}'")
-
-        # TODO: should be fatal error?
-        if this_subj.shape[0] != 1:
-            print(f"WARNING: {this_subj.shape[0]} matching rows for sub-{sub} (ses={ses}). Check participants.tsv, sessions.tsv, and/or --session_mapping for duplicates")
-
-        # only already defined if in sessions.tsv
-        # if we have the file, allow it to overwrite sessions.tsv
-        # e.g. maybe collected mprage on different day from rest
-        if not date or os.path.isfile(scans_file):
-            date = read_scan_date(scans_file, file)
-
-        sdate = date.split("-")
-        ndar_date = sdate[1] + "/" + sdate[2].split("T")[0] + "/" + sdate[0]
-        dict_append(image03_dict, 'interview_date', ndar_date)
-
-
-        interview_age = int(round(list(this_subj.age)[0]*12, 0))
-        dict_append(image03_dict, 'interview_age', interview_age)
-
-        sex = list(this_subj.sex)[0]
-        dict_append(image03_dict, 'gender', sex)
-
-        dict_append(image03_dict, 'image_file', file)
-
-        suffix = file.split("_")[-1].split(".")[0]
-        if suffix == "bold":
-            # task name ideally from sidecar ({'TaskName': '...'})
-            # but can resort to what's in the file name (_task-)
-            task = metadata.get("TaskName")
-            if not task:
-                task = metadata.get("task")
-                print(f"WARNING: TaskName is not in json sidecar for {file}. Using filename 'task-': {task}")
-            if not task:
-                raise Exception(f"No TaskName metadata nor task-* for bold file '{file}'")
-            description = suffix + " " + task
-            dict_append(image03_dict, 'experiment_id', metadata.get("ExperimentID", ""))
-        else:
-            description = suffix
-            dict_append(image03_dict, 'experiment_id', '')
-
-        # overwrite last experiment_id if we have a EID lookup file and a pattern match
-        if args.experimentid_tsv is not None and not image03_dict['experiment_id'][-1]:
-            if eid := eid_of_filename(args.experimentid_tsv, file):
-                image03_dict['experiment_id'][-1] = eid
-        if suffix == "bold" and not image03_dict['experiment_id'][-1]:
-            print(f"WARNING: no ExperimentID in sidecar for bold file '{file}'. This is likey to cause an error during NDA upload.")
-
-        # Shortcut for the global.const section -- apparently might not be flattened fully
-        metadata_const = metadata.get('global', {}).get('const', {})
-
-        # TODO: maybe warn and skip instead of error on unknown suffix
-        scan_type = suffix_to_scan_type.get(suffix)
-        if not scan_type:
-            raise Exception(f"ERROR: unknown scan_type for suffix {suffix} ({file})")
-
-        dict_append(image03_dict, 'image_description', description)
-        dict_append(image03_dict, 'scan_type', scan_type)
-        dict_append(image03_dict, 'scan_object', "Live")
-        dict_append(image03_dict, 'image_file_format', "NIFTI")
-        dict_append(image03_dict, 'image_modality', "MRI")
-        dict_append(image03_dict, 'scanner_manufacturer_pd', metadata.get("Manufacturer", ""))
-        dict_append(image03_dict, 'scanner_type_pd', metadata.get("ManufacturersModelName", ""))
-        dict_append(image03_dict, 'scanner_software_versions_pd', metadata.get("SoftwareVersions", ""))
-        dict_append(image03_dict, 'magnetic_field_strength', metadata.get("MagneticFieldStrength", ""))
-        dict_append(image03_dict, 'mri_echo_time_pd', metadata.get("EchoTime", ""))
-
-        flip_angle = metadata.get("FlipAngle", "")
-        if not flip_angle:
-            if suffix == "UNIT1":
-                flip_angle = 0
-                print(f"WANRING: flip angle not in json for {file}. Setting to {flip_angle} b/c suffix={suffix}")
-            else:
-                print(f"WARNING: flip angle is not set for {file}")
-        dict_append(image03_dict, 'flip_angle', flip_angle)
-
-        dict_append(image03_dict, 'receive_coil', metadata.get("ReceiveCoilName", ""))
-        # ImageOrientationPatientDICOM is populated by recent dcm2niix,
-        # and ImageOrientationPatient might be provided by exhastive metadata
-        # record done by heudiconv
-        iop = metadata.get(
-            'ImageOrientationPatientDICOM',
-            metadata_const.get("ImageOrientationPatient", None)
-        )
-        dict_append(image03_dict, 'image_orientation', cosine_to_orientation(iop) if iop else '')
-
-        dict_append(image03_dict, 'transformation_performed', 'Yes')
-        dict_append(image03_dict, 'transformation_type', 'BIDS2NDA')
-
-        nii = nb.load(file)
-        dict_append(image03_dict, 'image_num_dimensions', len(nii.shape))
-        dict_append(image03_dict, 'image_extent1', nii.shape[0])
-        dict_append(image03_dict, 'image_extent2', nii.shape[1])
-        dict_append(image03_dict, 'image_extent3', nii.shape[2])
-        if len(nii.shape) > 3:
-            image_extent4 = nii.shape[3]
-        else:
-            image_extent4 = ""
-
-        dict_append(image03_dict, 'image_extent4', image_extent4)
-        if suffix == "bold":
-            extent4_type = "time"
-        elif description == "epi" and len(nii.shape) == 4:
-            extent4_type = "time"
-        elif suffix == "dwi":
-            extent4_type = "diffusion weighting"
-        else:
-            extent4_type = ""
-        dict_append(image03_dict, 'extent4_type', extent4_type)
-
-        dict_append(image03_dict, 'acquisition_matrix', "%g x %g" %(nii.shape[0], nii.shape[1]))
-
-        dict_append(image03_dict, 'image_resolution1', nii.header.get_zooms()[0])
-        dict_append(image03_dict, 'image_resolution2', nii.header.get_zooms()[1])
-        dict_append(image03_dict, 'image_resolution3', nii.header.get_zooms()[2])
-        dict_append(image03_dict, 'image_slice_thickness', metadata_const.get("SliceThickness", nii.header.get_zooms()[2]))
-
-        # 20250715: PhotometricInterpretation is required if not DICOM
-        #   quick check on DICOM of nii we (LNCD/WF) want to upload:
-        #    all  report MONOCRHOME2
-        # https://dicom.innolitics.com/ciods/rt-dose/image-pixel/00280004
-        # MONOCHROME2:
-        # > Pixel data represent a single monochrome image plane.
-        # > The minimum sample value is intended to be displayed as black after any VOI gray
-        # > scale transformations have been performed.
-        photomet = metadata_const.get("PhotometricInterpretation","")
-        if not photomet and suffix in ['dwi', 'bold', 'T1w', 'T2w', 'sbref', 'epi', 'UNIT1']:
-            photomet = 'MONOCHROME2'
-        if not photomet:
-            print(f"WARNING: PhotometricInterpretation not in metadata and unknown for {suffix} ({file})")
-        dict_append(image03_dict, 'photomet_interpret', photomet)
-
-        if len(nii.shape) > 3:
-            image_resolution4 = nii.header.get_zooms()[3]
+def find_niftis(bids_root: os.PathLike) -> list[str]:
+    """All subject level (no session) then all session level nifti files"""
+    return glob(os.path.join(bids_root, "sub-*", "*", "sub-*.nii.gz")) + \
+        glob(os.path.join(bids_root, "sub-*", "ses-*", "*", "sub-*_ses-*.nii.gz"))
+
+
+suffix_to_scan_type = {"dwi": "MR diffusion",
+                       "bold": "fMRI",
+                       "sbref": "fMRI",
+                       #""MR structural(MPRAGE)",
+                       "T1w": "MR structural (T1)",
+                       "UNIT1": "MR structural (MP2RAGE)",
+                       "PD": "MR structural (PD)",
+                       #"MR structural(FSPGR)",
+                       "T2w": "MR structural (T2)",
+                       "inplaneT2": "MR structural (T2)",
+                       "FLAIR": "FLAIR",
+                       "FLASH": "MR structural (FLASH)",
+                       #PET;
+                        #ASL;
+                        #microscopy;
+                        #MR structural(PD, T2);
+                        #MR structural(B0 map);
+                        #MR structural(B1 map);
+                        #single - shell DTI; multi - shell DTI: from bval/bvec, see diffusion.py
+                       "epi": "Field Map",
+                       "phase1": "Field Map",
+                       "phase2": "Field Map",
+                       "phasediff": "Field Map",
+                       "magnitude1": "Field Map",
+                       "magnitude2": "Field Map",
+                       "fieldmap": "Field Map"
+                       #X - Ray
+                       }
+
+# nibabel.data_dir / "standard.nii.gz" reports "unknown" xyzt unit types
+units_dict = {"mm": "Millimeters",
+              "sec": "Seconds",
+              "msec": "Milliseconds",
+              "unknown": "Unknown"}
+
+
+def image03_row(args, session: SessionContext, file: str, write_zip: bool = True,
+                json_cache: dict | None = None, zips: MetadataZips | None = None,
+                metadata: dict | None = None) -> OrderedDict:
+    """
+    Build one image03 row for nifti ``file`` in ``session``.
+    Also writes the file's metadata zip (into ``zips``, default one per scan) unless ``write_zip`` is False.
+    ``json_cache`` is passed to :py:func:`get_metadata_for_nifti`, unless ``metadata`` was already resolved.
+    """
+
+    if metadata is None:
+        metadata = get_metadata_for_nifti(args.bids_directory, file, json_cache)
+
+    row = OrderedDict()
+    row['subjectkey'] = session.guid
+    row['src_subject_id'] = session.sub
+    row['interview_date'] = ndar_date(session.scan_date(file))
+    row['interview_age'] = session.interview_age
+    row['gender'] = session.sex
+
+    row['image_file'] = file
+
+    suffix = file.split("_")[-1].split(".")[0]
+    if suffix == "bold":
+        # task name ideally from sidecar ({'TaskName': '...'})
+        # but can resort to what's in the file name (_task-)
+        task = metadata.get("TaskName")
+        if not task:
+            task = metadata.get("task")
+            warn("no_taskname", file, f"TaskName is not in json sidecar for {file}. Using filename 'task-': {task}")
+        if not task:
+            raise Exception(f"No TaskName metadata nor task-* for bold file '{file}'")
+        description = suffix + " " + task
+        row['experiment_id'] = metadata.get("ExperimentID", "")
+    else:
+        description = suffix
+        row['experiment_id'] = ''
+
+    # overwrite experiment_id if we have a EID lookup file and a pattern match
+    if args.experimentid_tsv is not None and not row['experiment_id']:
+        if eid := eid_of_filename(args.experimentid_tsv, file):
+            row['experiment_id'] = eid
+    if suffix == "bold" and not row['experiment_id']:
+        warn("no_experiment_id", file, f"no ExperimentID in sidecar for bold file '{file}'. This is likey to cause an error during NDA upload.")
+
+    # Shortcut for the global.const section -- apparently might not be flattened fully
+    metadata_const = metadata.get('global', {}).get('const', {})
+
+    # TODO: maybe warn and skip instead of error on unknown suffix
+    scan_type = suffix_to_scan_type.get(suffix)
+    if not scan_type:
+        raise Exception(f"ERROR: unknown scan_type for suffix {suffix} ({file})")
+
+    row['image_description'] = description
+    row['scan_type'] = scan_type
+    row['scan_object'] = "Live"
+    row['image_file_format'] = "NIFTI"
+    row['image_modality'] = "MRI"
+    row['scanner_manufacturer_pd'] = metadata.get("Manufacturer", "")
+    row['scanner_type_pd'] = metadata.get("ManufacturersModelName", "")
+    row['scanner_software_versions_pd'] = metadata.get("SoftwareVersions", "")
+    row['magnetic_field_strength'] = metadata.get("MagneticFieldStrength", "")
+    row['mri_echo_time_pd'] = metadata.get("EchoTime", "")
+
+    flip_angle = metadata.get("FlipAngle", "")
+    if not flip_angle:
+        if suffix == "UNIT1":
+            flip_angle = 0
+            warn("default_flip_angle", file, f"flip angle not in json for {file}. Setting to {flip_angle} b/c suffix={suffix}")
         else:
-            image_resolution4 = ""
-        dict_append(image03_dict, 'image_resolution4', image_resolution4)
-
-        # TODO: use units for each dim? Will 1-3 ever not be same type?
-        unit_type = units_dict.get(nii.header.get_xyzt_units()[0], 'Unknown')
-        if unit_type == 'Unknown':
-            print(f"WARNING: xyzt unit type of {file} is {unit_type}")
-
-        dict_append(image03_dict, 'image_unit1', unit_type)
-        dict_append(image03_dict, 'image_unit2', unit_type)
-        dict_append(image03_dict, 'image_unit3', unit_type)
-        if len(nii.shape) > 3:
-            image_unit4 = units_dict[nii.header.get_xyzt_units()[1]]
-            if image_unit4 == "Milliseconds":
-                TR = nii.header.get_zooms()[3]/1000.
-            else:
-                TR = nii.header.get_zooms()[3]
-            dict_append(image03_dict, 'mri_repetition_time_pd', TR)
+            warn("no_flip_angle", file, f"flip angle is not set for {file}")
+    row['flip_angle'] = flip_angle
+
+    row['receive_coil'] = metadata.get("ReceiveCoilName", "")
+    # ImageOrientationPatientDICOM is populated by recent dcm2niix,
+    # and ImageOrientationPatient might be provided by exhastive metadata
+    # record done by heudiconv
+    iop = metadata.get(
+        'ImageOrientationPatientDICOM',
+        metadata_const.get("ImageOrientationPatient", None)
+    )
+    row['image_orientation'] = cosine_to_orientation(iop) if iop else ''
+
+    row['transformation_performed'] = 'Yes'
+    row['transformation_type'] = 'BIDS2NDA'
+
+    nii = nb.load(file)
+    row['image_num_dimensions'] = len(nii.shape)
+    row['image_extent1'] = nii.shape[0]
+    row['image_extent2'] = nii.shape[1]
+    row['image_extent3'] = nii.shape[2]
+    if len(nii.shape) > 3:
+        image_extent4 = nii.shape[3]
+    else:
+        image_extent4 = ""
+
+    row['image_extent4'] = image_extent4
+    if suffix == "bold":
+        extent4_type = "time"
+    elif description == "epi" and len(nii.shape) == 4:
+        extent4_type = "time"
+    elif suffix == "dwi":
+        extent4_type = "diffusion weighting"
+    else:
+        extent4_type = ""
+    row['extent4_type'] = extent4_type
+
+    row['acquisition_matrix'] = "%g x %g" %(nii.shape[0], nii.shape[1])
+
+    row['image_resolution1'] = nii.header.get_zooms()[0]
+    row['image_resolution2'] = nii.header.get_zooms()[1]
+    row['image_resolution3'] = nii.header.get_zooms()[2]
+    row['image_slice_thickness'] = metadata_const.get("SliceThickness", nii.header.get_zooms()[2])
+
+    # 20250715: PhotometricInterpretation is required if not DICOM
+    #   quick check on DICOM of nii we (LNCD/WF) want to upload:
+    #    all  report MONOCRHOME2
+    # https://dicom.innolitics.com/ciods/rt-dose/image-pixel/00280004
+    # MONOCHROME2:
+    # > Pixel data represent a single monochrome image plane.
+    # > The minimum sample value is intended to be displayed as black after any VOI gray
+    # > scale transformations have been performed.
+    photomet = metadata_const.get("PhotometricInterpretation","")
+    if not photomet and suffix in ['dwi', 'bold', 'T1w', 'T2w', 'sbref', 'epi', 'UNIT1']:
+        photomet = 'MONOCHROME2'
+    if not photomet:
+        warn("no_photometric_interpretation", file, f"PhotometricInterpretation not in metadata and unknown for {suffix} ({file})")
+    row['photomet_interpret'] = photomet
+
+    if len(nii.shape) > 3:
+        image_resolution4 = nii.header.get_zooms()[3]
+    else:
+        image_resolution4 = ""
+    row['image_resolution4'] = image_resolution4
+
+    # TODO: use units for each dim? Will 1-3 ever not be same type?
+    unit_type = units_dict.get(nii.header.get_xyzt_units()[0], 'Unknown')
+    if unit_type == 'Unknown':
+        warn("unknown_units", file, f"xyzt unit type of {file} is {unit_type}")
+
+    row['image_unit1'] = unit_type
+    row['image_unit2'] = unit_type
+    row['image_unit3'] = unit_type
+    if len(nii.shape) > 3:
+        image_unit4 = units_dict[nii.header.get_xyzt_units()[1]]
+        if image_unit4 == "Milliseconds":
+            TR = nii.header.get_zooms()[3]/1000.
         else:
-            image_unit4 = ""
-            dict_append(image03_dict, 'mri_repetition_time_pd', metadata.get("RepetitionTime", ""))
-
-        dict_append(image03_dict, 'slice_timing', metadata.get("SliceTiming", ""))
-        dict_append(image03_dict, 'image_unit4', image_unit4)
+            TR = nii.header.get_zooms()[3]
+        row['mri_repetition_time_pd'] = TR
+    else:
+        image_unit4 = ""
+        row['mri_repetition_time_pd'] = metadata.get("RepetitionTime", "")
+
+    row['slice_timing'] = metadata.get("SliceTiming", "")
+    row['image_unit4'] = image_unit4
+
+    row['mri_field_of_view_pd'] = "%g x %g %s" % (nii.header.get_zooms()[0],
+                                                  nii.header.get_zooms()[1],
+                                                  units_dict[nii.header.get_xyzt_units()[0]])
+    row['patient_position'] = 'head first-supine'
+
+    row['visit'] = session.visit
+
+    if len(metadata) > 0 or suffix in ['bold', 'dwi']:
+        # with --since, only zips for new/changed rows are written (see run)
+        if zips is None:
+            zips = MetadataZips(args.bids_directory, args.output_directory)
+        if write_zip:
+            zips.add(file, metadata)
+        row['data_file2'] = zips.path(file)
+        row['data_file2_type'] = ("ZIP file with additional metadata from Brain Imaging "
+                              "Data Structure (http://bids.neuroimaging.io)")
+    else:
+        row['data_file2'] = ""
+        row['data_file2_type'] = ""
 
-        dict_append(image03_dict, 'mri_field_of_view_pd', "%g x %g %s" % (nii.header.get_zooms()[0],
-                                                                          nii.header.get_zooms()[1],
-                                                                          units_dict[nii.header.get_xyzt_units()[0]]))
-        dict_append(image03_dict, 'patient_position', 'head first-supine')
+    if suffix == "dwi":
+        # TODO write a more robust function for finding those files
+        bvec_file = file.split("_dwi")[0] + "_dwi.bvec"
+        if not os.path.exists(bvec_file):
+            bvec_file = os.path.join(args.bids_directory, "dwi.bvec")
 
-        if file.split(os.sep)[-1].split("_")[1].startswith("ses"):
-            visit = file.split(os.sep)[-1].split("_")[1][4:]
+        if os.path.exists(bvec_file):
+            row['bvecfile'] = bvec_file
         else:
-            visit = ""
-
-        dict_append(image03_dict, 'visit', visit)
-
-        if len(metadata) > 0 or suffix in ['bold', 'dwi']:
-            _, fname = os.path.split(file)
-            zip_name = fname.split(".")[0] + ".metadata.zip"
-
-            os.makedirs(args.output_directory, exist_ok=True)
+            row['bvecfile'] = ""
 
-            with zipfile.ZipFile(os.path.join(args.output_directory, zip_name), 'w', zipfile.ZIP_DEFLATED) as zipf:
+        bval_file = file.split("_dwi")[0] + "_dwi.bval"
+        if not os.path.exists(bval_file):
+            bval_file = os.path.join(args.bids_directory, "dwi.bval")
 
-                zipf.writestr(fname.replace(".nii.gz", ".json"), json.dumps(metadata, indent=4, sort_keys=True))
-                if suffix == "bold":
-                    #TODO write a more robust function for finding those files
-                    events_file = file.split("_bold")[0] + "_events.tsv"
-                    arch_name = os.path.split(events_file)[1]
-                    if not os.path.exists(events_file):
-                        task_name = file.split("_task-")[1].split("_")[0]
-                        events_file = os.path.join(args.bids_directory, "task-" + task_name + "_events.tsv")
-
-                    if os.path.exists(events_file):
-                        zipf.write(events_file, arch_name)
-
-            dict_append(image03_dict, 'data_file2', os.path.join(args.output_directory, zip_name))
-            dict_append(image03_dict, 'data_file2_type', "ZIP file with additional metadata from Brain Imaging "
-                                                                "Data Structure (http://bids.neuroimaging.io)")
+        if os.path.exists(bval_file):
+            row['bvalfile'] = bval_file
         else:
-            dict_append(image03_dict, 'data_file2', "")
-            dict_append(image03_dict, 'data_file2_type', "")
-
-        if suffix == "dwi":
-            # TODO write a more robust function for finding those files
-            bvec_file = file.split("_dwi")[0] + "_dwi.bvec"
-            if not os.path.exists(bvec_file):
-                bvec_file = os.path.join(args.bids_directory, "dwi.bvec")
-
-            if os.path.exists(bvec_file):
-                dict_append(image03_dict, 'bvecfile', bvec_file)
-            else:
-                dict_append(image03_dict, 'bvecfile', "")
-
-            bval_file = file.split("_dwi")[0] + "_dwi.bval"
-            if not os.path.exists(bval_file):
-                bval_file = os.path.join(args.bids_directory, "dwi.bval")
-
-            if os.path.exists(bval_file):
-                dict_append(image03_dict, 'bvalfile', bval_file)
-            else:
-                dict_append(image03_dict, 'bvalfile', "")
-            if os.path.exists(bval_file) or os.path.exists(bvec_file):
-                dict_append(image03_dict, 'bvek_bval_files', 'Yes')
-            else:
-                dict_append(image03_dict, 'bvek_bval_files', 'No')
+            row['bvalfile'] = ""
+        if os.path.exists(bval_file) or os.path.exists(bvec_file):
+            row['bvek_bval_files'] = 'Yes'
         else:
-            dict_append(image03_dict, 'bvecfile', "")
-            dict_append(image03_dict, 'bvalfile', "")
-            dict_append(image03_dict, 'bvek_bval_files', "")
-
-        # comply with image03 changes from 12/30/19
-        # https://nda.nih.gov/data_structure_history.html?short_name=image03
-        
-        dict_append(image03_dict, 'procdate', "")
-        dict_append(image03_dict, 'visnum', "")
-        dict_append(image03_dict, 'manifest', "")
-        dict_append(image03_dict, 'emission_wavelingth', "")
-        dict_append(image03_dict, 'objective_magnification', "")
-        dict_append(image03_dict, 'objective_na', "")
-        dict_append(image03_dict, 'immersion', "")
-        dict_append(image03_dict, 'exposure_time', "")
-        dict_append(image03_dict, 'camera_sn', "")
-        dict_append(image03_dict, 'block_number', "")
-        dict_append(image03_dict, 'level', "")
-        dict_append(image03_dict, 'cut_thickness', "")
-        dict_append(image03_dict, 'stain', "")
-        dict_append(image03_dict, 'stain_details', "")
-        dict_append(image03_dict, 'pipeline_stage', "")
-        dict_append(image03_dict, 'deconvolved', "")
-        dict_append(image03_dict, 'decon_software', "")
-        dict_append(image03_dict, 'decon_method', "")
-        dict_append(image03_dict, 'psf_type', "")
-        dict_append(image03_dict, 'psf_file', "")
-        dict_append(image03_dict, 'decon_snr', "")
-        dict_append(image03_dict, 'decon_iterations', "")
-        dict_append(image03_dict, 'micro_temmplate_name', "")
-        dict_append(image03_dict, 'in_stack', "")
-        dict_append(image03_dict, 'decon_template_name', "")
-        dict_append(image03_dict, 'stack', "")
-        dict_append(image03_dict, 'slices', "")
-        dict_append(image03_dict, 'slice_number', "")
-        dict_append(image03_dict, 'slice_thickness', "")
-        dict_append(image03_dict, 'type_of_microscopy', "")
-
-        # 20250715: warning on not included. Resolve by adding
-        # DeviceSerialNumber previously always empty. But might be in metadata
-        dict_append(image03_dict, 'deviceserialnumber', metadata.get("DeviceSerialNumber",""))
-        dict_append(image03_dict, 'comments_misc', "")
-        dict_append(image03_dict, 'image_thumbnail_file', "")
-
-    image03_df = pd.DataFrame(image03_dict)
+            row['bvek_bval_files'] = 'No'
+
+        # single/multi-shell from the gradients. inconsistent files stay "MR diffusion"
+        if row['bvalfile'] and row['bvecfile']:
+            try:
+                gradients = analyze_gradients(bval_file, bvec_file)
+                problems = gradients.check_volumes(image_extent4 or 1)
+            except ValueError as err:
+                gradients, problems = None, [f"unreadable: {err}"]
+            if problems:
+                warn("dwi_gradients", file, f"bval/bvec for {file}: {'; '.join(problems)}")
+            elif gradients.scan_type:
+                row['scan_type'] = gradients.scan_type
+    else:
+        row['bvecfile'] = ""
+        row['bvalfile'] = ""
+        row['bvek_bval_files'] = ""
+
+    # comply with image03 changes from 12/30/19
+    # https://nda.nih.gov/data_structure_history.html?short_name=image03
+    
+    row['procdate'] = ""
+    row['visnum'] = ""
+    row['manifest'] = ""
+    row['emission_wavelingth'] = ""
+    row['objective_magnification'] = ""
+    row['objective_na'] = ""
+    row['immersion'] = ""
+    row['exposure_time'] = ""
+    row['camera_sn'] = ""
+    row['block_number'] = ""
+    row['level'] = ""
+    row['cut_thickness'] = ""
+    row['stain'] = ""
+    row['stain_details'] = ""
+    row['pipeline_stage'] = ""
+    row['deconvolved'] = ""
+    row['decon_software'] = ""
+    row['decon_method'] = ""
+    row['psf_type'] = ""
+    row['psf_file'] = ""
+    row['decon_snr'] = ""
+    row['decon_iterations'] = ""
+    row['micro_temmplate_name'] = ""
+    row['in_stack'] = ""
+    row['decon_template_name'] = ""
+    row['stack'] = ""
+    row['slices'] = ""
+    row['slice_number'] = ""
+    row['slice_thickness'] = ""
+    row['type_of_microscopy'] = ""
+
+    # 20250715: warning on not included. Resolve by adding
+    # DeviceSerialNumber previously always empty. But might be in metadata
+    row['deviceserialnumber'] = metadata.get("DeviceSerialNumber","")
+    row['comments_misc'] = ""
+    row['image_thumbnail_file'] = ""
+
+    return row
+
+
+def read_guid_mapping(guid_file: os.PathLike) -> dict[str, str]:
+    """GUID tool output ``<participant_id> - <GUID>`` lines to dict"""
+    with open(guid_file) as f:
+        return dict([line.split(" - ") for line in f.read().split("\n") if line != ''])
+
+
+# conversion pipeline stages, each with its own workers (--stage-workers) and input queue
+CONVERT_STAGES = ("session", "metadata", "header", "zip")
+
+
+def stage_workers(value: str) -> tuple[str, int]:
+    """``--stage-workers`` value ``STAGE=N``"""
+    name, _, n = value.partition("=")
+    if name not in CONVERT_STAGES or not n.isdigit() or int(n) < 1:
+        raise argparse.ArgumentTypeError(f"expected STAGE=N with STAGE one of {CONVERT_STAGES} and N >= 1, not '{value}'")
+    return name, int(n)
+
+
+def queue_size(value: str) -> int:
+    """``--queue-size`` value. queue.Queue treats 0 or less as unbounded"""
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError(f"expected a queue size >= 1, not '{value}'")
+    return int(value)
+
+
+def drop_failed_rows(image03_df: pd.DataFrame, errors: dict[str, Exception] | None, failures: list) -> pd.DataFrame:
+    """Move rows whose ``image_file`` is in ``errors`` (from a --keep-going post-processing step) to ``failures``"""
+    if not errors:
+        return image03_df
+    failures.extend(errors.items())
+    return image03_df[~image03_df.image_file.isin(errors)].reset_index(drop=True)
+
+
+def run(args, failures: list | None = None) -> pd.DataFrame:
+    """
+    Build image03 DataFrame for all niftis in ``args.bids_directory``.
+    With ``args.keep_going``, scans that raise are appended to ``failures`` as (file, exception)
+    instead of stopping the whole conversion.
+    """
+    keep_going = getattr(args, 'keep_going', False)
+    if failures is None:
+        failures = []
+
+    # tar/zip BIDS_DIRECTORY: convert from a header-only shadow tree, report paths inside the archive
+    archive = None
+    if is_archive(args.bids_directory):
+        if any(getattr(args, option, None) for option in ('integrity', 'thumbnails', 'checksum')):
+            raise ValueError("--integrity, --thumbnails, and --checksum read voxel data. "
+                             "Extract the archive to use them")
+        archive, shadow = open_archive(args.bids_directory, args.output_directory)
+        args = copy.copy(args)
+        args.bids_directory = shadow
+
+    # already parsed when shared between datasets (see bids2nda.batch)
+    if isinstance(args.guid_mapping, dict):
+        guid_mapping = args.guid_mapping
+    else:
+        guid_mapping = read_guid_mapping(args.guid_mapping)
+
+    memory = None
+    if getattr(args, 'memory_report', False) or getattr(args, 'memory_budget', None):
+        memory = MemoryTracker(budget_mb=getattr(args, 'memory_budget', None))
+    progress = Progress(total=0, memory=memory)
+    with WarningTally() as tally, memory or nullcontext():
+        progress.set_stage("participants")
+        participants_df = read_participant_info(args.bids_directory, args.session_mapping)
+
+        # --since: digests of previously generated rows. only new or changed rows are kept
+        previous = None
+        if getattr(args, 'since', None):
+            previous = read_previous_digests(args.since)
+
+        progress.set_stage("discover")
+        files = find_niftis(args.bids_directory)
+        if getattr(args, 'only_files', None):
+            only = read_only_files(args.only_files)
+            if kept := rows_not_rerun(args.output_directory, only):
+                raise Exception(f"{args.output_directory}/image03.csv has {len(kept)} rows not in --only-files "
+                                f"(e.g. {kept[0]}) that would be overwritten. Rerun into a new OUTPUT_DIRECTORY")
+            files = [f for f in files if os.path.abspath(f) in only or (archive and archive.reported_path(f) in only)]
+        if getattr(args, 'integrity', None):
+            progress.set_stage(f"integrity ({args.integrity})")
+            corrupt = check_integrity(files, args.integrity, getattr(args, 'jobs', 1))
+            for file, reason in corrupt.items():
+                log.error(f"corrupt nifti {file}: {reason}")
+            if corrupt and not keep_going:
+                raise CorruptFileError(f"{len(corrupt)} corrupt nifti files (see above). Nothing written. "
+                                       "Use --keep-going to convert the rest")
+            failures.extend((file, CorruptFileError(reason)) for file, reason in corrupt.items())
+            files = [f for f in files if f not in corrupt]
+
+        progress.begin(len(files), "convert")
+
+        json_cache = {}
+        order = getattr(args, 'order', 'locality')
+        sessions = schedule(files, order)
+        stats = ScheduleStats.of(order, sessions)
+        rows = {}
+        zips = MetadataZips(args.bids_directory, args.output_directory,
+                            per_session=getattr(args, 'session_zip', False),
+                            shard=getattr(args, 'shard_output', False))
+        workers = dict(getattr(args, 'stage_workers', None) or [])
+        write_zip = previous is None
+
+        def resolve_session(item):
+            (sub, ses), session_files = item
+            try:
+                session = session_context(args.bids_directory, participants_df, guid_mapping, sub, ses)
+            except Exception as err:
+                return [StageError("session", (file,), err) for file in session_files]
+            return [(file, session) for file in session_files]
+
+        def resolve_metadata(item):
+            file, session = item
+            return [(file, session, get_metadata_for_nifti(args.bids_directory, file, json_cache))]
+
+        def read_header(item):
+            file, session, metadata = item
+            row = image03_row(args, session, file, write_zip=False, zips=zips, metadata=metadata)
+            return [(file, metadata, row)]
+
+        def write_zip_stage(item):
+            file, metadata, row = item
+            if write_zip and row['data_file2']:
+                zips.add(file, metadata)
+            return [(file, row)]
+
+        max_queued = getattr(args, 'queue_size', 64)
+        pipeline = Pipeline([Stage(name, func, workers.get(name, 1), max_queued) for name, func in
+                             zip(CONVERT_STAGES, [resolve_session, resolve_metadata, read_header, write_zip_stage])],
+                            output_size=max_queued)
+        with zips, closing(pipeline.run(sessions.items())) as results:
+            for result in results:
+                progress.update()
+                if isinstance(result, StageError):
+                    if not keep_going:
+                        raise result.error
+                    failures.append((result.item[0], result.error))
+                    continue
+                file, row = result
+                rows[file] = row
+        stats.stop()
+        log.info(stats.message(), extra={"schedule_stats": stats})
+        for name, stage_stats in pipeline.stats().items():
+            log.info(f"stage {name}: {stage_stats['workers']} workers, {stage_stats['items']} items, "
+                     f"busy {stage_stats['busy_seconds']:.2f}s, "
+                     f"max queue {stage_stats['max_queue_depth']}/{stage_stats['queue_size']}",
+                     extra={"pipeline_stats": {name: stage_stats}})
+
+        # rows in discovery order whatever order they were converted in
+        progress.set_stage("dataframe")
+        image03_dict = OrderedDict()
+        for file in files:
+            for key, value in rows.pop(file, {}).items():
+                dict_append(image03_dict, key, value)
+        image03_df = pd.DataFrame(image03_dict)
+        local_file = {}
+        if archive is not None and image03_df.shape[0]:
+            local_file = {archive.reported_path(f): f for f in image03_df.image_file}
+            image03_df["image_file"] = list(local_file)
+
+        if previous is not None:
+            progress.set_stage("delta zips")
+            image03_df, summary = select_delta(image03_df, previous)
+            with zips:
+                for row in image03_df.to_dict("records"):
+                    if row["data_file2"]:
+                        file = local_file.get(row["image_file"], row["image_file"])
+                        zips.add(file, get_metadata_for_nifti(args.bids_directory, file, json_cache))
+
+        if getattr(args, 'thumbnails', False) and image03_df.shape[0]:
+            progress.set_stage("thumbnails")
+            thumbnail_errors = {} if keep_going else None
+            image03_df["image_thumbnail_file"] = make_thumbnails(
+                list(image03_df.image_file), args.output_directory,
+                getattr(args, 'jobs', 1), getattr(args, 'shard_output', False), thumbnail_errors)
+            image03_df = drop_failed_rows(image03_df, thumbnail_errors, failures)
+
+        if getattr(args, 'checksum', None):
+            progress.set_stage("checksum")
+            checksum_errors = {} if keep_going else None
+            image03_df = add_manifests(image03_df, args.output_directory, args.checksum,
+                                       getattr(args, 'jobs', 1), getattr(args, 'shard_output', False),
+                                       checksum_errors)
+            image03_df = drop_failed_rows(image03_df, checksum_errors, failures)
+
+    # delta summary, warnings, and errors are written even if no zips were
+    os.makedirs(args.output_directory, exist_ok=True)
+    if previous is not None:
+        write_delta_summary(summary, args.output_directory)
+    tally.log_summary()
+    tally.write(args.output_directory)
+    if memory is not None:
+        memory.log_report()
+        memory.write(args.output_directory)
+
+    if archive is not None:
+        archive.close()
+        failures[:] = [(archive.reported_path(file), err) for file, err in failures]
+
+    if failures:
+        errors_file = write_failures(failures, args.output_directory)
+        log.warning(f"{len(failures)} files failed. See {errors_file}. "
+                    f"Rerun those into a new OUTPUT_DIRECTORY with --only-files {errors_file}")
+    else:
+        remove_failures(args.output_directory)
 
     return image03_df
 
@@ -538,6 +739,96 @@ def parse_args(argv:list[str]|None=None):
         type=str,
         default=None,
         help='Path to auxiliary TSV to supplement or replace sessions.tsv/participants.tsv')
+    parser.add_argument(
+        '--format',
+        type=str,
+        default='csv',
+        choices=['csv'] + list(COLUMNAR_FORMATS),
+        help='Also write image03 with typed columns in this format (needs pyarrow). image03.csv is always written')
+    parser.add_argument(
+        '--since',
+        type=str,
+        default=None,
+        metavar='PREVIOUS_IMAGE03_CSV',
+        help='Only output rows (and metadata zips) that are new or changed compared to a previous image03.csv')
+    parser.add_argument(
+        '--session-zip',
+        action='store_true',
+        help='Write one metadata zip per session (sub-X_ses-Y.metadata.zip) instead of one per scan')
+    parser.add_argument(
+        '--shard-output',
+        action='store_true',
+        help='Put metadata zips in per subject subdirectories of OUTPUT_DIRECTORY')
+    parser.add_argument(
+        '--estimate',
+        type=int,
+        nargs='?',
+        const=50,
+        default=None,
+        metavar='N',
+        help='Do not convert. Time each conversion stage on a stratified sample of N (default 50) scans and extrapolate runtime (with --stage-workers), output size, and warning/error rates')
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='Parallel workers for --checksum, --integrity full, and --thumbnails. Conversion stages use --stage-workers')
+    parser.add_argument(
+        '--checksum',
+        type=str,
+        default=None,
+        choices=['md5', 'sha256'],
+        help='Hash nifti, zip, and bvec/bval files (cached in checksums.tsv) and write a manifest json per row for the manifest column')
+    parser.add_argument(
+        '--stage-workers',
+        type=stage_workers,
+        action='append',
+        metavar='STAGE=N',
+        help=f'Threads for a conversion stage ({", ".join(CONVERT_STAGES)}). Repeat for each stage. Default 1 each')
+    parser.add_argument(
+        '--queue-size',
+        type=queue_size,
+        default=64,
+        help='Max scans waiting between conversion stages. A slow stage blocks the ones before it at this depth')
+    parser.add_argument(
+        '--order',
+        type=str,
+        default='locality',
+        choices=ORDERS,
+        help='Conversion order. locality: by subject/session directory then inode (default). discovery: as found. Rows are written in discovery order either way')
+    parser.add_argument(
+        '--integrity',
+        type=str,
+        default=None,
+        choices=INTEGRITY_LEVELS,
+        help='Check niftis before converting. quick: gzip size trailer vs header (no decompression). full: also verify gzip CRC (uses --jobs processes)')
+    parser.add_argument(
+        '--memory-report',
+        action='store_true',
+        help='Trace peak memory per stage and per 1000 scans (tracemalloc + RSS). Logged and written to image03_memory.json. Slows conversion')
+    parser.add_argument(
+        '--memory-budget',
+        type=float,
+        default=None,
+        metavar='MB',
+        help='Warn if traced python memory peaks above this many MB (implies --memory-report)')
+    parser.add_argument(
+        '--thumbnails',
+        action='store_true',
+        help='Write a PNG of the middle slice of each image (first volume) for image_thumbnail_file')
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='Show every warning instead of the first few of each kind (all are counted in image03_warnings.json)')
+    parser.add_argument(
+        '--keep-going',
+        action='store_true',
+        help='Record failing files in image03_errors.tsv and continue. image03.csv has all other rows. Exits non-zero on any failure')
+    parser.add_argument(
+        '--only-files',
+        type=str,
+        default=None,
+        metavar='FILE',
+        help='Only convert niftis listed in FILE (one path per line or image03_errors.tsv from --keep-going). Use a new OUTPUT_DIRECTORY')
 
     args = parser.parse_args(argv)
 
@@ -549,16 +840,39 @@ def parse_args(argv:list[str]|None=None):
     return args
 
 
+def write_image03(image03_df: pd.DataFrame, output_directory: os.PathLike) -> str:
+    """Write NDA ``image03.csv`` (with ``"image","3"`` first line). Returns its path"""
+    os.makedirs(output_directory, exist_ok=True)
+    out_file = os.path.join(output_directory, "image03.csv")
+    with open(out_file, "w") as out_fp:
+        out_fp.write('"image","3"\n')
+        image03_df.to_csv(out_fp, sep=",", index=False, quoting=csv.QUOTE_ALL)
+    return out_file
+
+
 def main():
 
     args = parse_args()
-    image03_df = run(args)
+    setup_logging(args.verbose)
 
-    with open(os.path.join(args.output_directory, "image03.csv"), "w") as out_fp:
-        out_fp.write('"image","3"\n')
-        image03_df.to_csv(out_fp, sep=",", index=False, quoting=csv.QUOTE_ALL)
+    if args.estimate is not None:
+        # local import: estimate builds on this module's functions
+        from .estimate import estimate, log_estimate
+        log_estimate(estimate(args, args.estimate))
+        return
+
+    failures = []
+    image03_df = run(args, failures)
+
+    write_image03(image03_df, args.output_directory)
+
+    if args.format != 'csv':
+        write_columnar(image03_df, args.output_directory, args.format)
 
-    print("Metadata extraction complete.")
+    if failures:
+        log.error(f"Metadata extraction incomplete: {len(failures)} failed, {image03_df.shape[0]} converted.")
+        sys.exit(1)
+    log.info("Metadata extraction complete.")
 
 
 if __name__ == '__main__':
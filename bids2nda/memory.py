@@ -0,0 +1,164 @@
+"""
+Opt-in peak memory tracking for a conversion (``--memory-report``).
+
+Python allocations are traced with tracemalloc. Process RSS is sampled on a background
+thread, which also catches numpy/nibabel buffers and allocator overhead. Peaks are kept
+per stage (the stages :py:class:`~bids2nda.progress.Progress` logs) and per block of 1000 scans,
+logged at the end and written to ``image03_memory.json``. Tracing costs time. Leave it off
+for production runs.
+"""
+import json
+import os
+import sys
+import threading
+import tracemalloc
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+from .progress import log
+
+MB = 1024 * 1024
+
+
+def current_rss() -> int | None:
+    """Resident set size in bytes. None where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss() -> int:
+    """Peak RSS of the process so far in bytes. 0 where unavailable"""
+    if resource is None:
+        return 0
+    # ru_maxrss is kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryTracker:
+    """
+    Use as a context manager around a run. :py:meth:`stage` closes the current stage's
+    peak and starts the next. :py:meth:`scans` closes a per-``block``-scans window.
+    """
+
+    def __init__(self, block: int = 1000, interval: float = 0.05, budget_mb: float | None = None):
+        self.block = block
+        self.interval = interval
+        self.budget_mb = budget_mb
+        self.stages: OrderedDict[str, dict] = OrderedDict()
+        self.blocks: list[dict] = []
+        self._stage = None
+        self._block_start = 0
+        self._block_traced_peak = 0
+        self._stage_traced_peak = 0
+        self._rss_peak = 0
+        self._block_rss_peak = 0
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started_tracing = False
+
+    # -- sampling
+    def _sample_rss(self) -> None:
+        rss = current_rss()
+        if rss is not None:
+            self._rss_peak = max(self._rss_peak, rss)
+            self._block_rss_peak = max(self._block_rss_peak, rss)
+
+    def _sample_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample_rss()
+
+    def _traced_peak(self) -> int:
+        """Peak traced bytes since the last reset. Resets it and folds it into the stage and block peaks"""
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        self._stage_traced_peak = max(self._stage_traced_peak, peak)
+        self._block_traced_peak = max(self._block_traced_peak, peak)
+        return peak
+
+    # -- windows
+    def stage(self, name: str | None) -> None:
+        """End the current stage (recording its peaks) and start ``name``"""
+        self._sample_rss()
+        self._traced_peak()
+        traced = self._stage_traced_peak
+        if self._stage is not None:
+            entry = self.stages.setdefault(self._stage, {"traced_peak_mb": 0.0, "rss_peak_mb": 0.0})
+            entry["traced_peak_mb"] = max(entry["traced_peak_mb"], round(traced / MB, 2))
+            entry["rss_peak_mb"] = max(entry["rss_peak_mb"], round(self._rss_peak / MB, 2))
+        self._stage = name
+        self._stage_traced_peak = 0
+        self._rss_peak = current_rss() or 0
+
+    def scans(self, done: int) -> None:
+        """Called as scans finish. Records a window every ``block`` scans"""
+        if done - self._block_start < self.block:
+            return
+        self._sample_rss()
+        self._traced_peak()
+        self.blocks.append({"scans": done,
+                            "traced_mb": round(tracemalloc.get_traced_memory()[0] / MB, 2),
+                            "traced_peak_mb": round(self._block_traced_peak / MB, 2),
+                            "rss_peak_mb": round(self._block_rss_peak / MB, 2)})
+        self._block_start = done
+        self._block_traced_peak = 0
+        self._block_rss_peak = current_rss() or 0
+
+    # -- results
+    @property
+    def peak_traced_mb(self) -> float:
+        return max((s["traced_peak_mb"] for s in self.stages.values()), default=0.0)
+
+    @property
+    def peak_rss_mb(self) -> float:
+        return round(max_rss() / MB, 2)
+
+    @property
+    def over_budget(self) -> bool:
+        return self.budget_mb is not None and self.peak_traced_mb > self.budget_mb
+
+    def report(self) -> dict:
+        return {"peak_traced_mb": self.peak_traced_mb, "peak_rss_mb": self.peak_rss_mb,
+                "budget_mb": self.budget_mb, "stages": self.stages, "per_scans": self.blocks}
+
+    def log_report(self) -> None:
+        for name, peaks in self.stages.items():
+            log.info(f"memory {name}: python peak {peaks['traced_peak_mb']} MB, rss peak {peaks['rss_peak_mb']} MB")
+        for block in self.blocks:
+            log.info(f"memory at {block['scans']} scans: python {block['traced_mb']} MB "
+                     f"(peak {block['traced_peak_mb']} MB), rss peak {block['rss_peak_mb']} MB")
+        log.info(f"memory peak: python {self.peak_traced_mb} MB, process rss {self.peak_rss_mb} MB")
+        if self.over_budget:
+            log.warning(f"python peak memory {self.peak_traced_mb} MB is over the {self.budget_mb} MB budget")
+
+    def write(self, output_directory: os.PathLike) -> str:
+        """``image03_memory.json``"""
+        out_file = os.path.join(output_directory, "image03_memory.json")
+        with open(out_file, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        return out_file
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        tracemalloc.reset_peak()
+        self._rss_peak = self._block_rss_peak = current_rss() or 0
+        self._sampler = threading.Thread(target=self._sample_loop, daemon=True, name="memory-sampler")
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stage(None)
+        self._stop.set()
+        self._sampler.join()
+        if self._started_tracing:
+            tracemalloc.stop()
+        return False
@@ -0,0 +1,117 @@
+"""
+Writing the ``data_file2`` metadata zips: merged json sidecar and events.tsv of each scan.
+
+By default there is one ``<scan>.metadata.zip`` per nifti in a flat OUTPUT_DIRECTORY.
+At 100k+ scans that is a lot of tiny files for a parallel filesystem. Alternatively
+  * ``per_session``: one ``sub-X_ses-Y.metadata.zip`` holds every scan of the session
+  * ``shard``: zips go into ``OUTPUT_DIRECTORY/sub-X/`` instead of one flat directory
+"""
+import json
+import os
+import threading
+import zipfile
+
+
+def metadata_zip_path(output_directory: os.PathLike, file: str,
+                      per_session: bool = False, shard: bool = False) -> str:
+    """Output path of the sidecar/events zip for nifti ``file``"""
+    _, fname = os.path.split(file)
+    entities = fname.split("_")
+    if shard:
+        output_directory = os.path.join(output_directory, entities[0])
+    if per_session:
+        session_entities = [e for e in entities if e.startswith("sub-") or e.startswith("ses-")]
+        return os.path.join(output_directory, "_".join(session_entities) + ".metadata.zip")
+    return os.path.join(output_directory, fname.split(".")[0] + ".metadata.zip")
+
+
+def find_events_file(bids_root: os.PathLike, file: str) -> tuple[str, str] | None:
+    """(path, name in archive) of the events.tsv for a bold ``file``, if one exists"""
+    #TODO write a more robust function for finding those files
+    events_file = file.split("_bold")[0] + "_events.tsv"
+    arch_name = os.path.split(events_file)[1]
+    if not os.path.exists(events_file):
+        task_name = file.split("_task-")[1].split("_")[0]
+        events_file = os.path.join(bids_root, "task-" + task_name + "_events.tsv")
+
+    if os.path.exists(events_file):
+        return events_file, arch_name
+    return None
+
+
+def add_scan_to_zip(zipf: zipfile.ZipFile, bids_root: os.PathLike, file: str, metadata: dict) -> None:
+    """Add ``file``'s merged json ``metadata`` (and events.tsv for bold) to an open archive"""
+    _, fname = os.path.split(file)
+    zipf.writestr(fname.replace(".nii.gz", ".json"), json.dumps(metadata, indent=4, sort_keys=True))
+    if file.split("_")[-1].split(".")[0] == "bold":
+        if events := find_events_file(bids_root, file):
+            zipf.write(*events)
+
+
+class MetadataZips:
+    """
+    Writes scans into their metadata zip with the configured layout.
+    A per session archive stays open while consecutive scans of that session are added.
+    Use as a context manager (or call :py:meth:`close`) so the last archive is finalized.
+    """
+
+    def __init__(self, bids_root: os.PathLike, output_directory: os.PathLike,
+                 per_session: bool = False, shard: bool = False):
+        self.bids_root = bids_root
+        self.output_directory = output_directory
+        self.per_session = per_session
+        self.shard = shard
+        self._open_path: str | None = None
+        self._open_zip: zipfile.ZipFile | None = None
+        self._written: set[str] = set()
+        self._lock = threading.Lock()
+
+    def path(self, file: str) -> str:
+        """``data_file2`` value for ``file``"""
+        return metadata_zip_path(self.output_directory, file, self.per_session, self.shard)
+
+    def add(self, file: str, metadata: dict) -> str:
+        """Write ``file``'s metadata to its archive. Returns the archive path.
+        Safe to call from several threads (per session archives are then written one scan at a time)"""
+        zip_path = self.path(file)
+        if not self.per_session:
+            # one archive per scan: nothing shared, threads write in parallel
+            os.makedirs(os.path.dirname(zip_path) or ".", exist_ok=True)
+            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+                add_scan_to_zip(zf, self.bids_root, file, metadata)
+            with self._lock:
+                self._written.add(zip_path)
+            return zip_path
+        with self._lock:
+            if zip_path != self._open_path:
+                self._close()
+                os.makedirs(os.path.dirname(zip_path) or ".", exist_ok=True)
+                # a session seen again (out of order input) is appended to, not truncated
+                mode = 'a' if zip_path in self._written else 'w'
+                self._open_zip = zipfile.ZipFile(zip_path, mode, zipfile.ZIP_DEFLATED)
+                self._open_path = zip_path
+                self._written.add(zip_path)
+            add_scan_to_zip(self._open_zip, self.bids_root, file, metadata)
+        return zip_path
+
+    @property
+    def written(self) -> set[str]:
+        """Archives created so far"""
+        return set(self._written)
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._open_zip is not None:
+            self._open_zip.close()
+        self._open_zip = None
+        self._open_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
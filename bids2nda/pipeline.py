@@ -0,0 +1,149 @@
+"""
+Threaded stages connected by bounded queues.
+
+Each :py:class:`Stage` has its own worker threads and input queue. A full queue blocks the
+stage feeding it, so a slow stage (e.g. zip writes on a busy filesystem) slows everything
+upstream instead of letting finished work pile up in memory. Every stage reports its
+queue depth and the time its workers spent busy.
+
+Stage functions take one item and return a list of items for the next stage (empty to drop,
+several to fan out). An exception becomes a :py:class:`StageError` that later stages pass
+through untouched, so the consumer decides whether to stop or keep going.
+"""
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator
+
+_DONE = object()
+
+
+@dataclass
+class StageError:
+    stage: str
+    item: Any
+    error: Exception
+
+
+class Stage:
+    def __init__(self, name: str, func: Callable[[Any], list], workers: int = 1, queue_size: int = 64):
+        if workers < 1:
+            raise ValueError(f"stage '{name}' needs at least 1 worker, not {workers}")
+        if queue_size < 1:
+            # queue.Queue would make 0 or less unbounded
+            raise ValueError(f"stage '{name}' needs a queue size of at least 1, not {queue_size}")
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.busy_seconds = 0.0
+        self.items = 0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+        self._running = workers
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "items": self.items, "busy_seconds": round(self.busy_seconds, 3),
+                "queue_depth": self.queue.qsize(), "max_queue_depth": self.max_depth,
+                "queue_size": self.queue.maxsize}
+
+
+class Pipeline:
+    """
+    Run items through stages in order::
+
+        pipeline = Pipeline([Stage("read", read, 2), Stage("write", write)])
+        for result in pipeline.run(items):
+            ...
+
+    Leaving the loop early (break or exception) stops all workers.
+    """
+
+    def __init__(self, stages: list[Stage], output_size: int = 64):
+        if output_size < 1:
+            raise ValueError(f"output queue size must be at least 1, not {output_size}")
+        self.stages = stages
+        self.output: queue.Queue = queue.Queue(maxsize=output_size)
+        self._stop = threading.Event()
+
+    # -- queue helpers that give up once the pipeline is stopped
+    def _put(self, q: queue.Queue, item, stage: Stage | None = None) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            if stage is not None:
+                stage.max_depth = max(stage.max_depth, q.qsize())
+            return True
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _next(self, index: int) -> tuple[queue.Queue, Stage | None]:
+        if index + 1 < len(self.stages):
+            stage = self.stages[index + 1]
+            return stage.queue, stage
+        return self.output, None
+
+    def _feed(self, items: Iterable) -> None:
+        for item in items:
+            if not self._put(self.stages[0].queue, item, self.stages[0]):
+                return
+        self._put(self.stages[0].queue, _DONE)
+
+    def _work(self, index: int) -> None:
+        stage = self.stages[index]
+        out, next_stage = self._next(index)
+        while True:
+            item = self._get(stage.queue)
+            if item is _DONE:
+                # let sibling workers see it too. the last one out tells the next stage
+                self._put(stage.queue, _DONE)
+                with stage._lock:
+                    stage._running -= 1
+                    last = stage._running == 0
+                if last:
+                    self._put(out, _DONE, next_stage)
+                return
+            if isinstance(item, StageError):
+                results = [item]
+            else:
+                start = time.perf_counter()
+                try:
+                    results = stage.func(item)
+                except Exception as err:
+                    results = [StageError(stage.name, item, err)]
+                with stage._lock:
+                    stage.busy_seconds += time.perf_counter() - start
+                    stage.items += 1
+            for result in results:
+                if not self._put(out, result, next_stage):
+                    return
+
+    def run(self, items: Iterable) -> Iterator:
+        """Results of the last stage (and StageErrors) as they finish. Order is not preserved with >1 worker"""
+        threads = [threading.Thread(target=self._feed, args=(items,), daemon=True, name="pipeline-feed")]
+        for index, stage in enumerate(self.stages):
+            threads += [threading.Thread(target=self._work, args=(index,), daemon=True,
+                                         name=f"pipeline-{stage.name}-{i}") for i in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while (result := self._get(self.output)) is not _DONE:
+                yield result
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+    def stats(self) -> dict[str, dict]:
+        """stage name -> workers, items, busy_seconds, queue_depth, max_queue_depth, queue_size"""
+        return {stage.name: stage.stats() for stage in self.stages}
@@ -0,0 +1,147 @@
+"""
+Logging for long conversions: throughput/ETA progress and aggregated per-scan warnings.
+
+Per-scan warnings (missing flip angle, unknown units, ...) are logged with a ``category``.
+On the console only the first few of each category are shown.
+:py:class:`WarningTally` counts all of them for an end-of-run summary and ``image03_warnings.json``.
+"""
+import json
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+
+log = logging.getLogger("bids2nda")
+
+
+def warn(category: str, file: str, message: str) -> None:
+    """Log a per-scan warning that is aggregated by ``category``"""
+    log.warning(message, extra={"category": category, "file": file})
+
+
+class RepeatFilter(logging.Filter):
+    """Pass only the first ``max_repeats`` records of each warning category.
+    The rest are counted by :py:class:`WarningTally`"""
+
+    def __init__(self, max_repeats: int = 3):
+        super().__init__()
+        self.max_repeats = max_repeats
+        self.seen: dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = getattr(record, "category", None)
+        if category is None:
+            return True
+        self.seen[category] = self.seen.get(category, 0) + 1
+        return self.seen[category] <= self.max_repeats
+
+
+class WarningTally(logging.Handler):
+    """
+    Count categorized warnings and keep a few example files for each.
+    Use as a context manager to attach to the ``bids2nda`` logger for the length of a run.
+    """
+
+    def __init__(self, n_examples: int = 5):
+        super().__init__(level=logging.WARNING)
+        self.n_examples = n_examples
+        self.categories: OrderedDict[str, dict] = OrderedDict()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        category = getattr(record, "category", None)
+        if category is None:
+            return
+        tally = self.categories.setdefault(category, {"count": 0, "message": record.getMessage(), "examples": []})
+        tally["count"] += 1
+        if len(tally["examples"]) < self.n_examples:
+            tally["examples"].append(getattr(record, "file", ""))
+
+    def counts(self) -> dict[str, int]:
+        return {category: tally["count"] for category, tally in self.categories.items()}
+
+    def log_summary(self) -> None:
+        for category, tally in self.categories.items():
+            log.info(f"{tally['count']} x {category}. e.g. {tally['message']}")
+
+    def write(self, output_directory: os.PathLike) -> str:
+        """``image03_warnings.json``: {category: {count, message, examples}}"""
+        out_file = os.path.join(output_directory, "image03_warnings.json")
+        with open(out_file, "w") as f:
+            json.dump(self.categories, f, indent=2)
+        return out_file
+
+    def __enter__(self):
+        log.addHandler(self)
+        return self
+
+    def __exit__(self, *exc):
+        log.removeHandler(self)
+        return False
+
+
+def format_duration(seconds: float) -> str:
+    """``HH:MM:SS``. Hours keep counting past 24"""
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class Progress:
+    """
+    Log ``done/total files, files/s, ETA [stage]`` at most every ``interval`` seconds.
+    Rate and ETA are measured from :py:meth:`begin` (or creation), so setup stages before it do not count.
+    """
+
+    def __init__(self, total: int, interval: float = 5.0, clock=time.monotonic, memory=None):
+        self.total = total
+        self.memory = memory  # MemoryTracker told about stage changes and finished scans
+        self.interval = interval
+        self.clock = clock
+        self.done = 0
+        self.stage = ""
+        self.start = clock()
+        self._last = self.start
+
+    def begin(self, total: int, stage: str) -> None:
+        """Start counting ``total`` files in ``stage``, with the rate measured from now"""
+        self.total = total
+        self.done = 0
+        self.start = self._last = self.clock()
+        self.set_stage(stage)
+
+    def set_stage(self, stage: str) -> None:
+        self.stage = stage
+        log.info(f"stage: {stage}")
+        if self.memory is not None:
+            self.memory.stage(stage)
+
+    def rate(self) -> float:
+        elapsed = self.clock() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def message(self) -> str:
+        rate = self.rate()
+        remaining = self.total - self.done
+        eta = format_duration(remaining / rate) if rate > 0 else "?"
+        return f"{self.done}/{self.total} files {rate:.1f} files/s ETA {eta} [{self.stage}]"
+
+    def update(self, n: int = 1) -> None:
+        self.done += n
+        if self.memory is not None:
+            self.memory.scans(self.done)
+        now = self.clock()
+        if now - self._last >= self.interval or self.done == self.total:
+            self._last = now
+            log.info(self.message())
+
+
+def setup_logging(verbose: bool = False) -> None:
+    """Console logging for the command line tools. ``verbose`` shows every warning"""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+    if not verbose:
+        handler.addFilter(RepeatFilter())
+    log.handlers = [h for h in log.handlers if not isinstance(h, logging.StreamHandler)]
+    log.addHandler(handler)
+    log.setLevel(logging.DEBUG if verbose else logging.INFO)
+    log.propagate = False
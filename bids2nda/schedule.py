@@ -0,0 +1,108 @@
+"""
+Order in which scans are converted (``--order``). Rows are always emitted in discovery order.
+
+``find_niftis`` returns no-session files then session files in whatever order the
+directory listings came back. "locality" instead walks sessions in sorted
+subject/session order and, inside a session directory, by inode number -- on most
+filesystems close to on-disk order -- so one directory's sidecars, scans.tsv, and
+niftis are read together and readahead/page cache are not thrashed between sessions.
+"""
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from .session_info import SessionKey, group_by_session, session_key
+
+ORDERS = ("locality", "discovery")
+
+
+def directory_inodes(directories) -> dict[str, int]:
+    """path -> inode for every entry of ``directories``. From the directory listing (d_ino), no stat per file"""
+    inodes = {}
+    for directory in directories:
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    inodes[entry.path] = entry.inode()
+        except OSError:
+            pass
+    return inodes
+
+
+def locality_order(files: list[str]) -> list[str]:
+    """``files`` sorted by subject, session, datatype directory, then inode (0 where unavailable)"""
+    inodes = directory_inodes({os.path.dirname(f) for f in files})
+
+    def key(file):
+        sub, ses = session_key(file)
+        return sub, ses or "", os.path.dirname(file), inodes.get(file, 0), file
+    return sorted(files, key=key)
+
+
+def schedule(files: list[str], order: str = "locality") -> "OrderedDict[SessionKey, list[str]]":
+    """Sessions (and their files) in the order they should be converted"""
+    if order not in ORDERS:
+        raise ValueError(f"unknown order '{order}'. Use one of {ORDERS}")
+    if order == "locality":
+        files = locality_order(files)
+    return group_by_session(files)
+
+
+def directory_switches(files: list[str]) -> int:
+    """Times consecutive files are in different directories"""
+    dirs = [os.path.dirname(f) for f in files]
+    return sum(a != b for a, b in zip(dirs, dirs[1:]))
+
+
+def backward_steps(files: list[str], inodes: dict[str, int] | None = None) -> int:
+    """Times a file's inode is lower than the one before it in the same directory (a seek back on disk)"""
+    if inodes is None:
+        inodes = directory_inodes({os.path.dirname(f) for f in files})
+    return sum(os.path.dirname(a) == os.path.dirname(b) and inodes.get(b, 0) < inodes.get(a, 0)
+               for a, b in zip(files, files[1:]))
+
+
+def storage_read_bytes() -> int | None:
+    """Bytes this process has read from storage (page cache hits excluded). None where /proc is not available"""
+    try:
+        with open("/proc/self/io") as f:
+            return int(next(line for line in f if line.startswith("read_bytes")).split()[1])
+    except (OSError, ValueError, StopIteration):
+        return None
+
+
+@dataclass
+class ScheduleStats:
+    """
+    How well a conversion order kept related reads together. Sidecars and sessions are cached
+    for the whole run, so their hit rates are the same in any order and are not reported here.
+    ``read_bytes`` is what the conversion read from storage: ~0 when the dataset is already
+    in the page cache, None where ``/proc/self/io`` is not available.
+    """
+    order: str
+    sessions: int
+    files: int
+    directory_switches: int
+    backward_steps: int
+    start: float = field(default_factory=time.perf_counter, repr=False)
+    start_read_bytes: int | None = field(default_factory=storage_read_bytes, repr=False)
+    seconds: float = 0.0
+    read_bytes: int | None = None
+
+    @classmethod
+    def of(cls, order: str, sessions: "OrderedDict[SessionKey, list[str]]"):
+        files = [f for session_files in sessions.values() for f in session_files]
+        return cls(order, len(sessions), len(files), directory_switches(files), backward_steps(files))
+
+    def stop(self) -> None:
+        self.seconds = time.perf_counter() - self.start
+        end_read_bytes = storage_read_bytes()
+        if self.start_read_bytes is not None and end_read_bytes is not None:
+            self.read_bytes = end_read_bytes - self.start_read_bytes
+
+    def message(self) -> str:
+        read = f"{self.read_bytes / 1e6:.1f} MB" if self.read_bytes is not None else "n/a"
+        return (f"{self.order} order: {self.files} files in {self.sessions} sessions, "
+                f"{self.directory_switches} directory switches, {self.backward_steps} backward inode steps, "
+                f"{read} read from storage, {self.seconds:.2f}s")
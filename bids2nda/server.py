@@ -0,0 +1,234 @@
+"""
+Long-lived local conversion service for on-demand image03 rows.
+
+Participants/sessions index, GUID map, ExperimentID lookup, session contexts, and
+inherited sidecars stay in memory between requests. HTTP + JSON on localhost:
+
+  POST /rows        {"files": ["/bids/sub-1/ses-2/anat/sub-1_ses-2_T1w.nii.gz", ...]}
+                    or {"sub": "1", "ses": "2"} (ses null/omitted for no session directory)
+                    -> {"rows": [{image03 columns...}], "failures": [{"file": ..., "error": ...}]}
+                    metadata zips are written to OUTPUT_DIRECTORY as in a normal run
+  POST /invalidate  {} drops every cache, or {"sub": "1", "ses": "2"} that session, its subject's
+                    sidecars, and the participants/sessions index
+  GET  /stats       cache sizes, hit/miss counts, and request latency
+
+    bids2nda-serve --port 8765 BIDS_DIRECTORY GUID_MAPPING OUTPUT_DIRECTORY [bids2nda options]
+"""
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from glob import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .archive import is_archive
+from .main import MyParser, image03_row, parse_args, read_guid_mapping
+from .metadata_zip import MetadataZips
+from .progress import log, setup_logging
+from .session_info import SessionContext, read_participant_info, session_context, session_key
+
+
+class CountingCache(dict):
+    """dict that counts membership tests as cache hits/misses (used as ``json_cache``)"""
+
+    def __init__(self):
+        super().__init__()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key) -> bool:
+        found = super().__contains__(key)
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found
+
+
+class ConversionService:
+    """Conversion state shared by all requests. Methods are serialized with a lock"""
+
+    def __init__(self, args, n_latencies: int = 1000):
+        if is_archive(args.bids_directory):
+            raise ValueError(f"{args.bids_directory} is an archive. bids2nda-serve needs an extracted BIDS_DIRECTORY "
+                             "(a conversion can read the archive directly)")
+        self.args = args
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=n_latencies)
+        self.n_requests = 0
+        self.invalidate()
+
+    # -- caches
+    def invalidate(self, sub: str | None = None, ses: str | None = None) -> None:
+        """
+        Drop all cached state, or just what one session's rows depend on (e.g. after its scans.tsv
+        changed): its context, the participants/sessions index, and the subject's sidecars.
+        Top level inherited sidecars are only reloaded by a full invalidate.
+        """
+        if sub is not None:
+            self.sessions.pop((sub, ses), None)
+            self.participants_df = None
+            subject_dir = os.path.join(self.args.bids_directory, f"sub-{sub}") + os.sep
+            for path in [p for p in self.json_cache if p.startswith(subject_dir)]:
+                del self.json_cache[path]
+            return
+        self.guid_mapping = self.args.guid_mapping if isinstance(self.args.guid_mapping, dict) \
+            else read_guid_mapping(self.args.guid_mapping)
+        self.participants_df = None
+        self.sessions: dict[tuple, SessionContext] = {}
+        self.json_cache = CountingCache()
+        self.session_hits = 0
+        self.session_misses = 0
+
+    def _participants(self):
+        if self.participants_df is None:
+            self.participants_df = read_participant_info(self.args.bids_directory, self.args.session_mapping)
+        return self.participants_df
+
+    def session(self, sub: str, ses: str | None) -> SessionContext:
+        """Cached session context. A session missing from the cached participant index reloads it once"""
+        if (sub, ses) in self.sessions:
+            self.session_hits += 1
+            return self.sessions[(sub, ses)]
+        self.session_misses += 1
+        try:
+            context = session_context(self.args.bids_directory, self._participants(), self.guid_mapping, sub, ses)
+        except Exception:
+            # newly arrived session may not be in the participants/sessions index we loaded
+            self.participants_df = None
+            context = session_context(self.args.bids_directory, self._participants(), self.guid_mapping, sub, ses)
+        self.sessions[(sub, ses)] = context
+        return context
+
+    # -- requests
+    def session_files(self, sub: str, ses: str | None) -> list[str]:
+        if ses:
+            return sorted(glob(os.path.join(self.args.bids_directory, f"sub-{sub}", f"ses-{ses}", "*",
+                                            f"sub-{sub}_ses-{ses}_*.nii.gz")))
+        return sorted(glob(os.path.join(self.args.bids_directory, f"sub-{sub}", "*", f"sub-{sub}_*.nii.gz")))
+
+    def rows(self, files: list[str]) -> dict:
+        """image03 rows (and metadata zips) for nifti ``files``"""
+        rows = []
+        failures = []
+        zips = MetadataZips(self.args.bids_directory, self.args.output_directory,
+                            per_session=getattr(self.args, 'session_zip', False),
+                            shard=getattr(self.args, 'shard_output', False))
+        with self.lock, zips:
+            for file in files:
+                try:
+                    session = self.session(*session_key(file))
+                    rows.append(image03_row(self.args, session, file, json_cache=self.json_cache, zips=zips))
+                except Exception as err:
+                    failures.append({"file": file, "error": f"{type(err).__name__}: {err}"})
+        return {"rows": rows, "failures": failures}
+
+    def record_latency(self, seconds: float) -> None:
+        self.n_requests += 1
+        self.latencies.append(seconds)
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        latency = {}
+        if latencies:
+            latency = {"mean": statistics.fmean(latencies),
+                       "p50": latencies[len(latencies) // 2],
+                       "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                       "max": latencies[-1]}
+        return {
+            "requests": self.n_requests,
+            "latency_seconds": latency,
+            "sessions": {"cached": len(self.sessions), "hits": self.session_hits, "misses": self.session_misses},
+            "sidecars": {"cached": len(self.json_cache), "hits": self.json_cache.hits,
+                         "misses": self.json_cache.misses},
+            "participants_loaded": self.participants_df is not None,
+        }
+
+
+def _to_json(value):
+    """numpy scalars (nibabel zooms) to python"""
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    service: ConversionService = None  # set by make_server
+
+    def _reply(self, status: int, body: dict) -> None:
+        payload = json.dumps(body, default=_to_json).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._reply(200, self.service.stats())
+        else:
+            self._reply(404, {"error": f"unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        try:
+            request = self._body()
+        except json.JSONDecodeError as err:
+            self._reply(400, {"error": f"invalid json: {err}"})
+            return
+        if self.path == "/rows":
+            if "files" in request:
+                files = request["files"]
+            elif "sub" in request:
+                files = self.service.session_files(request["sub"], request.get("ses"))
+            else:
+                self._reply(400, {"error": "need 'files' or 'sub' (and 'ses')"})
+                return
+            body = self.service.rows(files)
+            # record before replying so a client's next /stats sees this request
+            self.service.record_latency(time.perf_counter() - start)
+            self._reply(200, body)
+        elif self.path == "/invalidate":
+            with self.service.lock:
+                self.service.invalidate(request.get("sub"), request.get("ses"))
+            self._reply(200, {"invalidated": request.get("sub", "all")})
+        else:
+            self._reply(404, {"error": f"unknown endpoint {self.path}"})
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s" % (self.address_string(), format % args))
+
+
+def make_server(service: ConversionService, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    handler = type("BoundConversionHandler", (ConversionHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv: list[str] | None = None):
+    parser = MyParser(description="Serve image03 rows for a BIDS dataset from a warm cache. "
+                                  "Remaining arguments are the same as bids2nda.", add_help=True)
+    parser.add_argument('--host', default="127.0.0.1", help='Address to listen on (default localhost only)')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    server_args, rest = parser.parse_known_args(argv if argv is not None else sys.argv[1:])
+    args = parse_args(rest)
+    setup_logging(args.verbose)
+
+    server = make_server(ConversionService(args), server_args.host, server_args.port)
+    log.info(f"serving {args.bids_directory} on http://{server_args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
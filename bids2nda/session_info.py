@@ -4,10 +4,16 @@ Age, Sex, and AcqTime from BIDS standard files or from auxiliary lookups.
 """
 import os.path
 import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
 from glob import glob
+from typing import Iterable
 
 import pandas as pd
 
+from .progress import log, warn
+
 
 def sub_from_file(path: str) -> str | None:
     """Quick subj extraction from file path.
@@ -31,7 +37,7 @@ def outer_merge(
     Include session_id in merge if exists in both inputs.
     """
 
-    print(f"Using {auth_df.shape[0]} {auth_desc} rows ({auth_df.columns})")
+    log.info(f"Using {auth_df.shape[0]} {auth_desc} rows ({list(auth_df.columns)})")
     # do we have what we need to merge
     shared_cols = set(auth_df.columns).intersection(set(participants_df.columns))
     if "participant_id" not in shared_cols:
@@ -42,8 +48,8 @@ def outer_merge(
     # are we overwriting data?
     overlap = shared_cols - {"participant_id", "session_id"}
     if len(overlap) != 0:
-        print(
-            f"WARNING: {auth_desc} and {part_desc} share overlapping columns {overlap}."
+        log.warning(
+            f"{auth_desc} and {part_desc} share overlapping columns {overlap}."
             + f"Will keep only values from {auth_desc}."
         )
 
@@ -89,7 +95,7 @@ def read_participant_info(
     if os.path.isfile(participants_file):
         participants_df = pd.read_csv(participants_file, header=0, sep="\t")
     else:
-        print(f"WARNING: {participants_file} does not exist.")
+        log.warning(f"{participants_file} does not exist.")
         participants_df = pd.DataFrame(columns=["participant_id"])
 
     # higher priority: session values stored in per sub- folder
@@ -121,20 +127,124 @@ def read_participant_info(
     return participants_df
 
 
-def read_scan_date(scans_file: str, file: str) -> str:
-    """Extract acq_time from scan_file.
-    Find row where filename column value matches ``file``"""
+def read_scans_index(scans_file: str) -> list[tuple[str, str]] | None:
+    """Read (filename, acq_time) rows of a scans.tsv once for all scans in a session.
+    ``None`` if the file does not exist."""
     if not os.path.exists(scans_file):
-        raise Exception(
-            f"{scans_file} file not found - 'acq_time' scan date required by NDA could not be found. Alternatively, column can be stored in sessions.tsv"
-            )
+        return None
     scans_df = pd.read_csv(scans_file, header=0, sep="\t")
     if "filename" not in scans_df.columns or "acq_time" not in scans_df.columns:
         raise Exception(
             f"{scans_file} must have columns 'filename' and 'acq_time' (YYYY-MM-DD) to create 'interview_date' nda column'"
         )
+    return [(fname.replace("/", os.sep), acq_time)
+            for fname, acq_time in zip(scans_df.filename, scans_df.acq_time)]
 
-    for _, row in scans_df.iterrows():
-        if file.endswith(row["filename"].replace("/", os.sep)):
-            return row.acq_time
+
+def scan_date_from_index(scans_index: list[tuple[str, str]] | None, scans_file: str, file: str) -> str:
+    """Find acq_time in ``scans_index`` for row where filename matches ``file``"""
+    if scans_index is None:
+        raise Exception(
+            f"{scans_file} file not found - 'acq_time' scan date required by NDA could not be found. Alternatively, column can be stored in sessions.tsv"
+            )
+    for fname, acq_time in scans_index:
+        if file.endswith(fname):
+            return acq_time
     raise Exception(f"no row where filename={file} in {scans_file}")
+
+
+def read_scan_date(scans_file: str, file: str) -> str:
+    """Extract acq_time from scan_file.
+    Find row where filename column value matches ``file``"""
+    return scan_date_from_index(read_scans_index(scans_file), scans_file, file)
+
+
+@lru_cache(maxsize=None)
+def ndar_date(date: str) -> str:
+    """BIDS acq_time (YYYY-MM-DD[Thh:mm:ss]) to NDA interview_date MM/DD/YYYY
+    >>> ndar_date('2020-12-31T10:00:00')
+    '12/31/2020'
+    """
+    sdate = date.split("-")
+    return sdate[1] + "/" + sdate[2].split("T")[0] + "/" + sdate[0]
+
+
+SessionKey = tuple[str, str | None]
+
+
+def session_key(file: str) -> SessionKey:
+    """(sub, ses) labels (without prefix) of a nifti path. ses is None without a session"""
+    sub = file.split("sub-")[-1].split("_")[0]
+    if "ses-" in file:
+        return sub, file.split("ses-")[-1].split("_")[0]
+    return sub, None
+
+
+def group_by_session(files: Iterable[str]) -> "OrderedDict[SessionKey, list[str]]":
+    """Group nifti paths by session, keeping first-seen order"""
+    sessions: OrderedDict[SessionKey, list[str]] = OrderedDict()
+    for file in files:
+        sessions.setdefault(session_key(file), []).append(file)
+    return sessions
+
+
+@dataclass
+class SessionContext:
+    """Values shared by every scan in a subject's session (or subject without sessions)"""
+    sub: str
+    ses: str | None
+    guid: str
+    interview_age: int
+    sex: str
+    visit: str
+    default_date: str | None  # acq_time from sessions.tsv/session mapping
+    scans_file: str
+    scans_index: list[tuple[str, str]] | None
+
+    def scan_date(self, file: str) -> str:
+        """acq_time of ``file``. scans.tsv, when it exists, overwrites sessions.tsv.
+        e.g. maybe collected mprage on different day from rest"""
+        if self.default_date and self.scans_index is None:
+            return self.default_date
+        return scan_date_from_index(self.scans_index, self.scans_file, file)
+
+
+def session_context(
+    bids_directory: os.PathLike,
+    participants_df: pd.DataFrame,
+    guid_mapping: dict[str, str],
+    sub: str,
+    ses: str | None,
+) -> SessionContext:
+    """Look up GUID, age, sex, and dates once for a session"""
+    guid = guid_mapping[sub]
+    date = None  # initialization. set by sessions.tsv or _scans.tsv
+    this_subj = participants_df[participants_df.participant_id == "sub-" + sub]
+    if ses is not None:
+        scans_file = os.path.join(bids_directory, "sub-" + sub, "ses-" + ses, "sub-" + sub + "_ses-" + ses + "_scans.tsv")
+        this_subj = this_subj[this_subj.session_id == 'ses-' + ses]
+        if this_subj.shape[0] == 0:
+            raise Exception(f"{bids_directory}/sub-{sub}/sub-{ses}_sessions.tsv must have row with session_id = ses-{ses}")
+        if 'acq_time' in this_subj.columns:
+            date = this_subj.acq_time.tolist()[0]
+    else:
+        scans_file = os.path.join(bids_directory, "sub-" + sub, "sub-" + sub + "_scans.tsv")
+        if this_subj.shape[0] == 0:
+            raise Exception(f"{bids_directory}/participants.tsv must have row with participant_id = 'sub-{sub}'")
+
+    # TODO: should be fatal error?
+    if this_subj.shape[0] != 1:
+        warn("duplicate_session_rows", f"sub-{sub}_ses-{ses}", f"{this_subj.shape[0]} matching rows for sub-{sub} (ses={ses}). Check participants.tsv, sessions.tsv, and/or --session_mapping for duplicates")
+
+    return SessionContext(
+        sub=sub,
+        ses=ses,
+        guid=guid,
+        interview_age=int(round(list(this_subj.age)[0]*12, 0)),
+        sex=list(this_subj.sex)[0],
+        visit=ses if ses is not None else "",
+        default_date=date,
+        scans_file=scans_file,
+        scans_index=read_scans_index(scans_file),
+    )
+
@@ -0,0 +1,196 @@
+"""
+Helpers for tests and benchmarks: synthetic BIDS datasets and deterministic I/O call counting.
+
+Wall clock time is noisy. Counting opens, stats, globs, and json parses per file
+catches the same scaling regressions (e.g. a sidecar reparsed for every scan) deterministically.
+"""
+import builtins
+import glob as glob_module
+import json
+import os
+import sys
+import threading
+from collections import Counter, defaultdict
+
+import nibabel as nb
+import numpy as np
+
+
+def _write_template(path: str, shape: tuple, zooms: tuple) -> None:
+    img = nb.Nifti1Image(np.zeros(shape, dtype=np.int16), np.eye(4))
+    img.header.set_zooms(zooms)
+    img.header.set_xyzt_units("mm", "sec")
+    nb.save(img, path)
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        with open(src, "rb") as fin, open(dst, "wb") as fout:
+            fout.write(fin.read())
+
+
+def make_bids_dataset(
+    root: os.PathLike,
+    n_subjects: int = 2,
+    n_sessions: int = 2,
+    tasks: tuple[str, ...] = ("rest",),
+    n_volumes: int = 5,
+) -> str:
+    """
+    Write a small but complete BIDS dataset to ``root``: participants.tsv, sessions.tsv, scans.tsv,
+    a T1w and one bold run per task for every session, and top level inherited task sidecars.
+    NIfTI files are hard links to one tiny template per type.
+    ``n_sessions=0`` makes a dataset without session directories.
+    Returns path to a matching GUID mapping file (written next to ``root``).
+    """
+    root = str(root)
+    os.makedirs(root, exist_ok=True)
+    templates = os.path.join(root, ".templates")
+    os.makedirs(templates, exist_ok=True)
+    t1_template = os.path.join(templates, "T1w.nii.gz")
+    bold_template = os.path.join(templates, "bold.nii.gz")
+    _write_template(t1_template, (4, 4, 3), (1.0, 1.0, 1.2))
+    _write_template(bold_template, (4, 4, 3, n_volumes), (3.0, 3.0, 3.5, 1.5))
+
+    for task in tasks:
+        with open(os.path.join(root, f"task-{task}_bold.json"), "w") as f:
+            json.dump({"TaskName": task, "ExperimentID": "1234", "RepetitionTime": 1.5}, f)
+
+    subjects = [f"{i:04d}" for i in range(1, n_subjects + 1)]
+    with open(os.path.join(root, "participants.tsv"), "w") as f:
+        f.write("participant_id\tsex\tage\n")
+        for i, sub in enumerate(subjects):
+            f.write(f"sub-{sub}\t{'MF'[i % 2]}\t{20 + i % 30}\n")
+
+    guid_file = root.rstrip(os.sep) + "_guid_map.txt"
+    with open(guid_file, "w") as f:
+        f.write("".join(f"{sub} - NDAR{sub}\n" for sub in subjects))
+
+    sessions = [str(s) for s in range(1, n_sessions + 1)] or [None]
+    for sub in subjects:
+        subdir = os.path.join(root, f"sub-{sub}")
+        os.makedirs(subdir, exist_ok=True)
+        if n_sessions:
+            with open(os.path.join(subdir, f"sub-{sub}_sessions.tsv"), "w") as f:
+                f.write("session_id\tacq_time\n")
+                f.write("".join(f"ses-{ses}\t20{10 + int(ses) % 90:02d}-01-0{1 + int(ses) % 9}\n" for ses in sessions))
+        for ses in sessions:
+            prefix = f"sub-{sub}" + (f"_ses-{ses}" if ses else "")
+            sesdir = os.path.join(subdir, f"ses-{ses}") if ses else subdir
+            scans = []
+            for datatype, name, template in (
+                [("anat", f"{prefix}_T1w", t1_template)]
+                + [("func", f"{prefix}_task-{task}_bold", bold_template) for task in tasks]
+            ):
+                os.makedirs(os.path.join(sesdir, datatype), exist_ok=True)
+                _link_or_copy(template, os.path.join(sesdir, datatype, name + ".nii.gz"))
+                with open(os.path.join(sesdir, datatype, name + ".json"), "w") as f:
+                    json.dump({"Manufacturer": "Siemens", "MagneticFieldStrength": 3,
+                               "FlipAngle": 8, "EchoTime": 0.03}, f)
+                scans.append(f"{datatype}/{name}.nii.gz")
+            with open(os.path.join(sesdir, f"{prefix}_scans.tsv"), "w") as f:
+                f.write("filename\tacq_time\n")
+                f.write("".join(f"{scan}\t2020-12-01T10:00:00\n" for scan in scans))
+    return guid_file
+
+
+class IOCounter:
+    """
+    Context manager counting ``open``, ``os.stat``, ``os.path.exists``, ``glob`` and ``json.load``.
+
+    Calls are counted per (operation, path) in ``by_file`` and per (operation, stage) in ``by_stage``,
+    where stage is the innermost calling ``bids2nda`` function (e.g. ``read_json``), or, with
+    ``stages``, the innermost of those functions on the stack (e.g. ``get_metadata_for_nifti`` to
+    count everything it does through helpers).
+    Calls made while handling another counted call (``exists`` calling ``stat``) are not counted twice.
+
+    >>> with IOCounter() as io_count:
+    ...     run(args)
+    >>> io_count.max_per_file("open", ".json")
+    """
+
+    def __init__(self, stages: tuple[str, ...] | None = None):
+        self.stages = stages
+        self.by_file: defaultdict[str, Counter] = defaultdict(Counter)
+        self.by_stage: defaultdict[str, Counter] = defaultdict(Counter)
+        self._local = threading.local()  # nesting depth per thread: conversion stages run in threads
+        self._lock = threading.Lock()
+        self._saved = []
+
+    def _stage(self) -> str:
+        frame = sys._getframe(2)
+        while frame is not None:
+            module = frame.f_globals.get("__name__", "")
+            if module.startswith("bids2nda") and module != __name__ and \
+                    (self.stages is None or frame.f_code.co_name in self.stages):
+                return frame.f_code.co_name
+            frame = frame.f_back
+        return "other"
+
+    def _wrap(self, op: str, func, path_arg: bool = True):
+        counter = self
+
+        def wrapped(*args, **kwargs):
+            depth = getattr(counter._local, "depth", 0)
+            if depth == 0:
+                path = ""
+                if path_arg and args:
+                    target = args[0]
+                    if op == "json.load":
+                        target = getattr(target, "name", "")
+                    if isinstance(target, (str, bytes, os.PathLike)):
+                        path = os.path.abspath(os.fsdecode(target))
+                    elif isinstance(target, int):
+                        path = f"<fd {target}>"
+                stage = counter._stage()
+                with counter._lock:
+                    counter.by_file[path][op] += 1
+                    counter.by_stage[stage][op] += 1
+            counter._local.depth = depth + 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                counter._local.depth = depth
+
+        return wrapped
+
+    def _patch(self, owner, name: str, op: str):
+        original = getattr(owner, name)
+        self._saved.append((owner, name, original))
+        setattr(owner, name, self._wrap(op, original))
+
+    def __enter__(self):
+        self._patch(builtins, "open", "open")
+        self._patch(os, "stat", "stat")
+        self._patch(os.path, "exists", "exists")
+        self._patch(json, "load", "json.load")
+        # modules that did ``from glob import glob``
+        original_glob = glob_module.glob
+        self._patch(glob_module, "glob", "glob")
+        for module in list(sys.modules.values()):
+            if getattr(module, "__name__", "").startswith("bids2nda") and \
+                    getattr(module, "glob", None) is original_glob:
+                self._patch(module, "glob", "glob")
+        return self
+
+    def __exit__(self, *exc):
+        for owner, name, original in reversed(self._saved):
+            setattr(owner, name, original)
+        self._lock = threading.Lock()
+        self._saved = []
+        return False
+
+    def total(self, op: str) -> int:
+        """All calls of ``op`` (e.g. 'open')"""
+        return sum(counts[op] for counts in self.by_file.values())
+
+    def per_file(self, op: str, suffix: str = "") -> dict[str, int]:
+        """``op`` count for every path ending in ``suffix``"""
+        return {path: counts[op] for path, counts in self.by_file.items()
+                if path.endswith(suffix) and counts[op]}
+
+    def max_per_file(self, op: str, suffix: str = "") -> int:
+        """Most ``op`` calls on any single path ending in ``suffix``"""
+        return max(self.per_file(op, suffix).values(), default=0)
@@ -0,0 +1,98 @@
+"""
+PNG thumbnails for the ``image_thumbnail_file`` image03 column (``--thumbnails``).
+
+Only the middle axial slice of the first volume is read through nibabel's array proxy
+(``img.dataobj[..., z, 0]``), so a 4D bold series is never fully decompressed and
+memory per worker stays around one slice. PNGs are written with a minimal
+grayscale encoder (zlib + crc32) instead of pulling in an imaging library.
+"""
+import os
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import nibabel as nb
+import numpy as np
+
+from .metadata_zip import metadata_zip_path
+
+
+def middle_slice(nifti_file: str) -> np.ndarray:
+    """Middle slice (3rd axis) of the first volume, read without loading the whole image"""
+    img = nb.load(nifti_file)
+    shape = img.shape
+    index = (slice(None), slice(None), shape[2] // 2) + (0,) * (len(shape) - 3)
+    return np.asanyarray(img.dataobj[index])
+
+
+def to_uint8(data: np.ndarray) -> np.ndarray:
+    """Scale 1st-99th percentile to 0-255 and rotate so anterior is up"""
+    data = np.nan_to_num(np.asarray(data, dtype=np.float32))
+    low, high = np.percentile(data, [1, 99]) if data.size else (0, 0)
+    if high <= low:
+        scaled = np.zeros_like(data)
+    else:
+        scaled = (np.clip(data, low, high) - low) / (high - low) * 255
+    return np.rot90(scaled).astype(np.uint8)
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def encode_png(gray: np.ndarray) -> bytes:
+    """8-bit grayscale PNG bytes for a 2D uint8 array"""
+    height, width = gray.shape
+    # filter type 0 (none) before each row
+    raw = b"".join(b"\x00" + row.tobytes() for row in np.ascontiguousarray(gray, dtype=np.uint8))
+    return (b"\x89PNG\r\n\x1a\n"
+            + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+            + _png_chunk(b"IDAT", zlib.compress(raw, 6))
+            + _png_chunk(b"IEND", b""))
+
+
+def thumbnail_path(output_directory: os.PathLike, file: str, shard: bool = False) -> str:
+    """``<scan>.thumbnail.png`` next to where the scan's metadata zip goes"""
+    return metadata_zip_path(output_directory, file, shard=shard).replace(".metadata.zip", ".thumbnail.png")
+
+
+def is_up_to_date(png_file: str, nifti_file: str) -> bool:
+    return os.path.exists(png_file) and os.path.getmtime(png_file) >= os.path.getmtime(nifti_file)
+
+
+def write_thumbnail(nifti_file: str, png_file: str) -> str:
+    """Render ``nifti_file``'s middle slice to ``png_file`` unless that is already newer than the nifti"""
+    if is_up_to_date(png_file, nifti_file):
+        return png_file
+    os.makedirs(os.path.dirname(png_file) or ".", exist_ok=True)
+    png = encode_png(to_uint8(middle_slice(nifti_file)))
+    with open(png_file, "wb") as f:
+        f.write(png)
+    return png_file
+
+
+def _thumbnail_or_error(nifti_file: str, png_file: str) -> str | Exception:
+    try:
+        return write_thumbnail(nifti_file, png_file)
+    except Exception as err:  # e.g. EOFError from a truncated .nii.gz
+        return err
+
+
+def make_thumbnails(files: list[str], output_directory: os.PathLike, jobs: int = 1,
+                    shard: bool = False, errors: dict[str, Exception] | None = None) -> list[str]:
+    """
+    Thumbnail for each nifti in ``files`` (in order), ``jobs`` processes at a time.
+    With ``errors``, a file that cannot be read is added to it as (file -> exception) and gets ""
+    instead of stopping the rest.
+    """
+    png_files = [thumbnail_path(output_directory, f, shard) for f in files]
+    render = write_thumbnail if errors is None else _thumbnail_or_error
+    if jobs <= 1:
+        results = [render(f, p) for f, p in zip(files, png_files)]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(render, files, png_files, chunksize=8))
+    for file, result in zip(files, results):
+        if isinstance(result, Exception):
+            errors[file] = result
+    return [result if isinstance(result, str) else "" for result in results]
@@ -53,6 +53,9 @@ setup(
                         "pandas",
                         'nibabel'],
 
+    # optional typed image03 output (--format parquet/feather/arrow)
+    extras_require={"columnar": ["pyarrow"]},
+
     include_package_data=True,
 
     # To provide executable scripts, use entry points in preference to the
@@ -61,6 +64,8 @@ setup(
     entry_points={
         'console_scripts': [
             'bids2nda=bids2nda.main:main',
+            'bids2nda-batch=bids2nda.batch:main',
+            'bids2nda-serve=bids2nda.server:main',
         ],
     },
 )
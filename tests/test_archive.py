@@ -0,0 +1,99 @@
+import os
+import tarfile
+import zipfile
+
+import nibabel as nb
+import numpy as np
+import pytest
+
+import bids2nda
+from bids2nda.archive import BidsArchive, open_archive
+from bids2nda.estimate import estimate
+from bids2nda.server import ConversionService
+from bids2nda.testing import make_bids_dataset
+
+
+def bids_with_events(tmpdir):
+    bids = str(tmpdir / "study")
+    guid_map = make_bids_dataset(bids, 2, 2)
+    with open(os.path.join(bids, "task-rest_events.tsv"), "w") as f:
+        f.write("onset\tduration\n0\t1\n")
+    # not part of the conversion. must not be read
+    os.makedirs(os.path.join(bids, "derivatives", "sub-0001"))
+    with open(os.path.join(bids, "derivatives", "sub-0001", "big.json"), "w") as f:
+        f.write("{}")
+    return bids, guid_map
+
+
+def pack(bids, archive_file):
+    if archive_file.endswith(".zip"):
+        with zipfile.ZipFile(archive_file, "w") as zf:
+            for root, _, files in os.walk(bids):
+                for name in files:
+                    path = os.path.join(root, name)
+                    zf.write(path, os.path.relpath(path, os.path.dirname(bids)))
+    else:
+        with tarfile.open(archive_file, "w") as tar:
+            tar.add(bids, arcname=os.path.basename(bids))
+    return archive_file
+
+
+@pytest.mark.parametrize("kind", ["tar", "zip"])
+def test_convert_from_archive(tmpdir, kind):
+    bids, guid_map = bids_with_events(tmpdir)
+    archive_file = pack(bids, str(tmpdir / f"study.{kind}"))
+    extracted = bids2nda.run(bids2nda.parse_args([bids, guid_map, str(tmpdir / "out_dir")]))
+    archived = bids2nda.run(bids2nda.parse_args([archive_file, guid_map, str(tmpdir / "out_archive")]))
+
+    assert list(archived.image_file) == [f.replace(bids, archive_file + "/study") for f in extracted.image_file]
+    same = [c for c in extracted.columns if c not in ("image_file", "data_file2")]
+    assert (archived[same].astype(str).values == extracted[same].astype(str).values).all()
+    # inherited events.tsv copied from the archive into the bold zip
+    bold_zip = [z for z in archived.data_file2 if "sub-0001_ses-1_task-rest_bold" in z][0]
+    assert "sub-0001_ses-1_task-rest_events.tsv" in zipfile.ZipFile(bold_zip).namelist()
+    shadow = os.path.join(tmpdir, "out_archive", ".bids_archive", f"study.{kind}")
+    assert not os.path.exists(os.path.join(shadow, "derivatives"))
+
+
+def test_reads_only_header_and_reuses_index(tmpdir, monkeypatch):
+    bids = str(tmpdir / "study")
+    make_bids_dataset(bids, 1, 0)
+    # incompressible voxel data so the member is much bigger than its header
+    big = nb.Nifti1Image(np.random.default_rng(0).random((32, 32, 16, 20), dtype=np.float32), np.eye(4))
+    nb.save(big, os.path.join(bids, "sub-0001", "func", "sub-0001_task-rest_bold.nii.gz"))
+    archive_file = pack(bids, str(tmpdir / "study.tar"))
+    out = str(tmpdir / "out")
+
+    archive, shadow = open_archive(archive_file, out)
+    assert archive.bytes_read < 64 * 1024 < os.path.getsize(archive_file) / 10
+    stub = nb.load(os.path.join(shadow, "sub-0001", "func", "sub-0001_task-rest_bold.nii.gz"))
+    assert stub.shape == (32, 32, 16, 20)
+    archive.close()
+
+    def no_rescan(self):
+        raise AssertionError("index should come from cache")
+    monkeypatch.setattr(BidsArchive, "_tar_index", no_rescan)
+    archive, _ = open_archive(archive_file, out)
+    assert archive.index_cached and archive.bytes_read == 0
+    archive.close()
+
+
+def test_compressed_tar_rejected(tmpdir):
+    bids = str(tmpdir / "study")
+    make_bids_dataset(bids, 1, 0)
+    archive_file = str(tmpdir / "study.tar.gz")
+    with tarfile.open(archive_file, "w:gz") as tar:
+        tar.add(bids, arcname="study")
+    with pytest.raises(ValueError, match="compressed tar"):
+        BidsArchive(archive_file)
+
+
+def test_estimate_and_server_reject_archives(tmpdir):
+    bids = str(tmpdir / "study")
+    guid_map = make_bids_dataset(bids, 1, 1)
+    args = bids2nda.parse_args([pack(bids, str(tmpdir / "study.tar")), guid_map, str(tmpdir / "out")])
+    with pytest.raises(ValueError, match="--estimate needs an extracted"):
+        estimate(args)
+    with pytest.raises(ValueError, match="bids2nda-serve needs an extracted"):
+        ConversionService(args)
+    assert not (tmpdir / "out").exists()
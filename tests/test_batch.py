@@ -0,0 +1,49 @@
+import os
+
+import pandas as pd
+import pytest
+
+from bids2nda import batch
+from bids2nda.testing import make_bids_dataset
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_batch_manifest(tmpdir, jobs):
+    guid_map = make_bids_dataset(str(tmpdir / "study1"), 2, 2)
+    make_bids_dataset(str(tmpdir / "study2"), 3, 0)  # same subjects, no sessions
+    with open(tmpdir / "manifest.tsv", "w") as f:
+        f.write("bids_directory\toutput_directory\toptions\n")
+        f.write(f"{tmpdir / 'study1'}\t{tmpdir / 'out1'}\t\n")
+        f.write(f"{tmpdir / 'study2'}\t{tmpdir / 'out2'}\t--keep-going\n")
+
+    with pytest.raises(SystemExit) as exit_info:
+        batch.main([str(tmpdir / "manifest.tsv"), guid_map, "--jobs", str(jobs),
+                    "--combined", str(tmpdir / "all")])
+    # study2 has sub-0003 not in study1's guid map
+    assert exit_info.value.code == 1
+
+    out1 = pd.read_csv(tmpdir / "out1/image03.csv", skiprows=1)
+    out2 = pd.read_csv(tmpdir / "out2/image03.csv", skiprows=1)
+    assert out1.shape[0] == 8
+    assert out2.shape[0] == 4
+    assert os.path.exists(tmpdir / "out2/image03_errors.tsv")
+    combined = pd.read_csv(tmpdir / "all/image03.csv", skiprows=1)
+    assert combined.shape[0] == 12
+
+
+def test_manifest_columns(tmpdir):
+    with open(tmpdir / "manifest.tsv", "w") as f:
+        f.write("bids\toutput_directory\n")
+    with pytest.raises(ValueError, match="missing column"):
+        batch.read_manifest(tmpdir / "manifest.tsv")
+
+
+def test_bad_options_fail_only_their_row(tmpdir):
+    guid_map = make_bids_dataset(str(tmpdir / "study1"), 2, 0)
+    make_bids_dataset(str(tmpdir / "study2"), 2, 0)
+    manifest = pd.DataFrame({"bids_directory": [str(tmpdir / "study1"), str(tmpdir / "study2")],
+                             "output_directory": [str(tmpdir / "out1"), str(tmpdir / "out2")],
+                             "options": ["--bogus-flag", ""]})
+    results = batch.run_batch(manifest, batch.read_guid_mapping(guid_map))
+    assert "invalid options '--bogus-flag'" in results[0]["error"]
+    assert results[1]["error"] == "" and results[1]["rows"] == 4
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+import bids2nda
+from bids2nda import checksum
+from bids2nda.checksum import ChecksumCache, checksum_files, file_digest
+from bids2nda.testing import make_bids_dataset
+
+
+def test_file_digest_chunks(tmpdir):
+    path = str(tmpdir / "data.bin")
+    data = os.urandom(10_000)
+    with open(path, "wb") as f:
+        f.write(data)
+    assert file_digest(path, "md5", chunk_size=1024) == hashlib.md5(data).hexdigest()
+    assert file_digest(path, "sha256") == hashlib.sha256(data).hexdigest()
+
+
+def test_cache_skips_unchanged(tmpdir):
+    paths = []
+    for i in range(4):
+        paths.append(str(tmpdir / f"f{i}"))
+        with open(paths[-1], "w") as f:
+            f.write(f"content {i}")
+    cache_file = str(tmpdir / "checksums.tsv")
+    cache = ChecksumCache(cache_file)
+    first = checksum_files(paths, "md5", jobs=2, cache=cache)
+    cache.save()
+
+    with open(paths[0], "w") as f:
+        f.write("changed and longer")
+    cache = ChecksumCache(cache_file)
+    second = checksum_files(paths, "md5", jobs=2, cache=cache)
+    assert cache.misses == 1  # only the changed file is hashed again
+    assert second[paths[1]] == first[paths[1]]
+    assert second[paths[0]] != first[paths[0]]
+
+
+def test_run_manifest_column(tmpdir):
+    bids = str(tmpdir / "bids")
+    guid_map = make_bids_dataset(bids, 1, 1)
+    out = str(tmpdir / "out")
+    args = bids2nda.parse_args([bids, guid_map, out, "--checksum", "md5", "--jobs", "2"])
+    imgdf = bids2nda.run(args)
+    assert all(imgdf.manifest.str.endswith(".manifest.json"))
+    with open(imgdf.manifest[0]) as f:
+        manifest = json.load(f)
+    names = [entry["name"] for entry in manifest["files"]]
+    assert names == [os.path.basename(imgdf.image_file[0]), os.path.basename(imgdf.data_file2[0])]
+    assert manifest["files"][0]["md5sum"] == file_digest(imgdf.image_file[0])
+    assert os.path.exists(os.path.join(out, "checksums.tsv"))
+
+
+def test_unreadable_files_keep_going(tmpdir, monkeypatch):
+    paths = [str(tmpdir / "ok"), str(tmpdir / "missing")]
+    with open(paths[0], "w") as f:
+        f.write("ok")
+    with pytest.raises(FileNotFoundError):
+        checksum_files(paths)
+    errors = {}
+    assert list(checksum_files(paths, errors=errors)) == [paths[0]]
+    assert list(errors) == [paths[1]]
+
+    # a read error in the middle of a run fails only that row under --keep-going
+    bids = str(tmpdir / "bids")
+    guid_map = make_bids_dataset(bids, 1, 1)
+    bad = os.path.join(bids, "sub-0001/ses-1/anat/sub-0001_ses-1_T1w.nii.gz")
+
+    def flaky_digest(path, algorithm="md5", chunk_size=checksum.CHUNK_SIZE):
+        if path == bad:
+            raise OSError(5, "Input/output error", path)
+        return file_digest(path, algorithm, chunk_size)
+    monkeypatch.setattr(checksum, "file_digest", flaky_digest)
+    failures = []
+    args = bids2nda.parse_args([bids, guid_map, str(tmpdir / "out"), "--checksum", "md5", "--keep-going"])
+    imgdf = bids2nda.run(args, failures)
+    assert bad not in list(imgdf.image_file) and imgdf.shape[0] == 1
+    assert [f for f, _ in failures] == [bad]
+    assert all(imgdf.manifest.str.endswith(".manifest.json"))
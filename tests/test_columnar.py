@@ -0,0 +1,43 @@
+import sys
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+import bids2nda
+from bids2nda.columnar import typed_image03, write_columnar
+
+
+def test_typed_image03_leaves_input():
+    df = pd.DataFrame({"image_extent4": [200, ""], "image_resolution1": [2.3, 1.0],
+                       "slice_timing": [[0, 1.5], ""], "image_file": ["a", "b"]})
+    typed = typed_image03(df)
+    assert str(typed.image_extent4.dtype) == "Int64"
+    assert pd.isna(typed.image_extent4[1])
+    assert typed.image_resolution1.dtype == "float64"
+    assert typed.slice_timing.tolist() == ["[0, 1.5]", ""]
+    # csv source untouched
+    assert df.image_extent4.tolist() == [200, ""]
+
+
+def test_parquet_and_csv_unchanged(tmpdir):
+    pytest.importorskip("pyarrow")
+    base = ["examples/bids-ses/", "examples/guid_map.txt"]
+    with patch.object(sys, "argv", ["bids2nda"] + base + [str(tmpdir / "csv")]):
+        bids2nda.main()
+    with patch.object(sys, "argv", ["bids2nda"] + base + [str(tmpdir / "pq"), "--format", "parquet"]):
+        bids2nda.main()
+
+    csv_only = open(tmpdir / "csv/image03.csv").read()
+    with_pq = open(tmpdir / "pq/image03.csv").read()
+    assert csv_only == with_pq.replace(str(tmpdir / "pq"), str(tmpdir / "csv"))
+
+    df = pd.read_parquet(tmpdir / "pq/image03.parquet", columns=["image_extent1", "interview_age"])
+    assert df.shape == (8, 2)
+    assert str(df.image_extent1.dtype) == "Int64"
+    assert str(df.interview_age.dtype) == "Int64"
+
+
+def test_write_columnar_bad_format(tmpdir):
+    with pytest.raises(ValueError, match="unknown columnar format"):
+        write_columnar(pd.DataFrame(), str(tmpdir), "xlsx")
@@ -0,0 +1,63 @@
+import json
+import os
+import shutil
+import sys
+from unittest.mock import patch
+
+import pandas as pd
+
+import bids2nda
+from bids2nda.delta import read_previous_digests
+from bids2nda.testing import make_bids_dataset
+
+
+def run_main(argv):
+    with patch.object(sys, "argv", ["bids2nda"] + argv):
+        bids2nda.main()
+
+
+def test_since(tmpdir):
+    bids = str(tmpdir / "bids")
+    shutil.copytree("examples/bids-ses", bids)
+    run_main([bids, "examples/guid_map.txt", str(tmpdir / "full")])
+    previous = str(tmpdir / "full/image03.csv")
+    assert len(read_previous_digests(previous)) == 8
+
+    # nothing changed: no rows, no zips. different output dir is not a change
+    run_main([bids, "examples/guid_map.txt", str(tmpdir / "none"), "--since", previous])
+    df = pd.read_csv(tmpdir / "none/image03.csv", skiprows=1)
+    assert df.shape[0] == 0
+    assert not [f for f in os.listdir(tmpdir / "none") if f.endswith(".zip")]
+
+    # change one sidecar, remove one scan
+    sidecar = os.path.join(bids, "sub-a/ses-1/anat/sub-a_ses-1_T1w.json")
+    with open(sidecar) as f:
+        meta = json.load(f)
+    meta["Manufacturer"] = "NewVendor"
+    with open(sidecar, "w") as f:
+        json.dump(meta, f)
+    os.remove(os.path.join(bids, "sub-b/ses-2/anat/sub-b_ses-2_T1w.nii.gz"))
+
+    run_main([bids, "examples/guid_map.txt", str(tmpdir / "delta"), "--since", previous])
+    df = pd.read_csv(tmpdir / "delta/image03.csv", skiprows=1)
+    assert df.image_file.tolist() == [sidecar.replace(".json", ".nii.gz")]
+    zips = [f for f in os.listdir(tmpdir / "delta") if f.endswith(".zip")]
+    assert zips == ["sub-a_ses-1_T1w.metadata.zip"]
+
+    summary = pd.read_csv(tmpdir / "delta/image03_delta.tsv", sep="\t")
+    assert summary.status.tolist() == ["changed", "removed"]
+
+
+def test_since_with_checksum_and_thumbnails(tmpdir):
+    bids = str(tmpdir / "bids")
+    guid_map = make_bids_dataset(bids, 2, 1)
+    options = ["--checksum", "md5", "--thumbnails"]
+    run_main([bids, guid_map, str(tmpdir / "full")] + options)
+    previous = str(tmpdir / "full/image03.csv")
+    full = pd.read_csv(previous, skiprows=1)
+    assert full.manifest.notna().all() and full.image_thumbnail_file.notna().all()
+
+    # manifests and thumbnails are only written for selected rows. their absence in an unchanged row is not a change
+    run_main([bids, guid_map, str(tmpdir / "none"), "--since", previous] + options)
+    summary = pd.read_csv(tmpdir / "none/image03_delta.tsv", sep="\t")
+    assert summary.shape[0] == 0
@@ -0,0 +1,72 @@
+import os
+
+import nibabel as nb
+import numpy as np
+
+import bids2nda
+from bids2nda import diffusion
+from bids2nda.diffusion import analyze_gradients, cluster_shells, count_directions
+from bids2nda.testing import make_bids_dataset
+
+
+def write_gradients(prefix, bvals, bvecs):
+    np.savetxt(prefix + ".bval", np.atleast_2d(bvals), fmt="%g")
+    np.savetxt(prefix + ".bvec", bvecs, fmt="%.6f")
+
+
+def directions(n):
+    """n distinct unit vectors in the upper hemisphere"""
+    theta = np.linspace(0.2, 1.3, n)
+    phi = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    return np.vstack([np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)])
+
+
+def test_cluster_shells():
+    assert cluster_shells(np.array([0, 5, 995, 1000, 1005, 2000, 1990])).round().tolist() == [1000, 1995]
+    assert cluster_shells(np.array([0, 0])).size == 0
+
+
+def test_count_directions_antipodal():
+    v = directions(6).T
+    assert count_directions(v) == 6
+    assert count_directions(np.vstack([v, -v])) == 6
+
+
+def test_analyze(tmpdir):
+    prefix = str(tmpdir / "dwi")
+    bvals = np.array([0, 1000, 1000, 1000, 2000, 2000, 2000])
+    bvecs = np.hstack([[[0], [0], [0]], directions(3), directions(3)])
+    write_gradients(prefix, bvals, bvecs)
+    info = analyze_gradients(prefix + ".bval", prefix + ".bvec")
+    assert info.shells == (1000, 2000)
+    assert info.n_b0 == 1 and info.n_directions == 3
+    assert info.scan_type == "multi-shell DTI"
+    assert info.check_volumes(7) == []
+    assert info.check_volumes(8) == ["7 gradients but nifti has 8 volumes"]
+
+    prefix = str(tmpdir / "bad")
+    write_gradients(prefix, bvals[:4], bvecs[:, :3])
+    info = analyze_gradients(prefix + ".bval", prefix + ".bvec")
+    assert info.problems == ("4 b-values but 3 b-vectors",)
+    assert info.scan_type is None
+
+
+def test_inherited_gradients_read_once(tmpdir):
+    bids = str(tmpdir / "bids")
+    guid_map = make_bids_dataset(bids, 3, 0)
+    write_gradients(os.path.join(bids, "dwi"), [0, 1000, 1000, 1000], np.hstack([[[0], [0], [0]], directions(3)]))
+    for sub in ["0001", "0002", "0003"]:
+        os.makedirs(os.path.join(bids, f"sub-{sub}", "dwi"))
+        nb.save(nb.Nifti1Image(np.zeros((4, 4, 3, 4 if sub != "0003" else 5), dtype=np.int16), np.eye(4)),
+                os.path.join(bids, f"sub-{sub}", "dwi", f"sub-{sub}_dwi.nii.gz"))
+        with open(os.path.join(bids, f"sub-{sub}", f"sub-{sub}_scans.tsv"), "a") as f:
+            f.write(f"dwi/sub-{sub}_dwi.nii.gz\t2020-01-01T00:00:00\n")
+
+    diffusion._load.cache_clear()
+    args = bids2nda.parse_args([bids, guid_map, str(tmpdir / "out")])
+    df = bids2nda.run(args)
+    dwi = df[df.image_file.str.endswith("_dwi.nii.gz")].set_index("src_subject_id")
+    # sub-0003 has an extra volume: flagged and left generic
+    assert dwi.scan_type.to_dict() == {"0001": "single-shell DTI", "0002": "single-shell DTI",
+                                       "0003": "MR diffusion"}
+    assert diffusion._load.cache_info().misses == 2  # dwi.bval + dwi.bvec
@@ -0,0 +1,42 @@
+import sys
+from unittest.mock import patch
+
+import bids2nda
+from bids2nda.estimate import estimate, stratified_sample
+from bids2nda.testing import make_bids_dataset
+
+
+def test_stratified_sample_covers_suffixes_and_subjects():
+    files = [f"b/sub-{s}/func/sub-{s}_task-rest_run-{r}_bold.nii.gz" for s in range(10) for r in range(10)]
+    files += ["b/sub-0/dwi/sub-0_dwi.nii.gz"]
+    sample = stratified_sample(files, 12, seed=1)
+    assert len(sample) == 12
+    assert "b/sub-0/dwi/sub-0_dwi.nii.gz" in sample
+    subjects = {f.split("/")[1] for f in sample if f.endswith("bold.nii.gz")}
+    assert len(subjects) == 10
+    assert stratified_sample(files, 12, seed=1) == sample
+    assert len(stratified_sample(files, 500)) == len(files)
+
+
+def test_estimate(tmpdir):
+    bids = str(tmpdir / "bids")
+    guid_map = make_bids_dataset(bids, 6, 2, tasks=("rest", "nback"))
+    args = bids2nda.parse_args([bids, guid_map, str(tmpdir / "out"), "--stage-workers", "header=4"])
+    report = estimate(args, sample_size=9)
+    assert report["files"] == 36
+    assert report["sampled"] == 9
+    assert report["metadata_zips"] == 36
+    assert report["error_rate"] == 0
+    assert report["output_bytes"] > 0
+    assert report["stage_workers"] == {"session": 1, "metadata": 1, "header": 4, "zip": 1}
+    assert set(report["stage_seconds"]) == {"session", "metadata", "header", "zip"}
+    # the slowest stage bounds the run. never faster than that, never slower than serial
+    slowest = max(seconds / report["stage_workers"][stage] for stage, seconds in report["stage_seconds"].items())
+    assert slowest - 0.001 <= report["seconds"] <= report["serial_seconds"]  # values are rounded to ms
+
+
+def test_estimate_cli_writes_nothing(tmpdir):
+    argv = ["bids2nda", "examples/bids-noses/", "examples/guid_map.txt", str(tmpdir / "out"), "--estimate", "2"]
+    with patch.object(sys, "argv", argv):
+        bids2nda.main()
+    assert not (tmpdir / "out").exists()
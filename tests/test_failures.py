@@ -0,0 +1,78 @@
+import os
+import shutil
+import sys
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+import bids2nda
+from bids2nda.main import suffix_to_scan_type
+
+
+def run_main(argv):
+    with patch.object(sys, "argv", ["bids2nda"] + argv):
+        bids2nda.main()
+
+
+def test_keep_going_and_only_files(tmpdir):
+    bids = str(tmpdir / "bids")
+    shutil.copytree("examples/bids-noses", bids)
+    weird = os.path.join(bids, "sub-a/anat/sub-a_weird.nii.gz")
+    shutil.copyfile(os.path.join(bids, "sub-a/anat/sub-a_T1w.nii.gz"), weird)
+    with open(os.path.join(bids, "sub-a/sub-a_scans.tsv"), "a") as f:
+        f.write("anat/sub-a_weird.nii.gz\t2020-12-01\n")
+
+    # default is still to stop on first error
+    with pytest.raises(Exception, match="unknown scan_type"):
+        run_main([bids, "examples/guid_map.txt", str(tmpdir / "out")])
+
+    with pytest.raises(SystemExit) as exit_info:
+        run_main([bids, "examples/guid_map.txt", str(tmpdir / "out"), "--keep-going"])
+    assert exit_info.value.code == 1
+
+    df = pd.read_csv(tmpdir / "out/image03.csv", skiprows=1)
+    assert df.shape[0] == 4
+    errors_file = str(tmpdir / "out/image03_errors.tsv")
+    errors = pd.read_csv(errors_file, sep="\t")
+    assert errors.file.tolist() == [weird]
+    assert "unknown scan_type" in errors.error[0]
+
+    # after "fixing" the input, only the failed file is reprocessed
+    with patch.dict(suffix_to_scan_type, {"weird": "MR structural (T1)"}):
+        run_main([bids, "examples/guid_map.txt", str(tmpdir / "rerun"), "--only-files", errors_file])
+    df = pd.read_csv(tmpdir / "rerun/image03.csv", skiprows=1)
+    assert df.image_file.tolist() == [weird]
+
+
+def test_only_files_protects_full_csv(tmpdir, monkeypatch):
+    guid_map = os.path.abspath("examples/guid_map.txt")
+    bids = str(tmpdir / "bids")
+    shutil.copytree("examples/bids-noses", bids)
+    weird = os.path.join(bids, "sub-a/anat/sub-a_weird.nii.gz")
+    shutil.copyfile(os.path.join(bids, "sub-a/anat/sub-a_T1w.nii.gz"), weird)
+    with open(os.path.join(bids, "sub-a/sub-a_scans.tsv"), "a") as f:
+        f.write("anat/sub-a_weird.nii.gz\t2020-12-01\n")
+    out = str(tmpdir / "out")
+    # relative BIDS_DIRECTORY: errors file still lists absolute paths
+    monkeypatch.chdir(tmpdir)
+    with pytest.raises(SystemExit):
+        run_main(["bids", guid_map, out, "--keep-going"])
+    errors_file = os.path.join(out, "image03_errors.tsv")
+    assert pd.read_csv(errors_file, sep="\t").file.tolist() == [weird]
+
+    with patch.dict(suffix_to_scan_type, {"weird": "MR structural (T1)"}):
+        # rerunning into the same directory would replace the 4 good rows
+        with pytest.raises(Exception, match="new OUTPUT_DIRECTORY"):
+            run_main([bids, guid_map, out, "--only-files", errors_file])
+        assert pd.read_csv(os.path.join(out, "image03.csv"), skiprows=1).shape[0] == 4
+
+        os.makedirs(tmpdir / "elsewhere")
+        monkeypatch.chdir(tmpdir / "elsewhere")
+        rerun = str(tmpdir / "rerun")
+        run_main([bids, guid_map, rerun, "--only-files", errors_file])
+        assert pd.read_csv(os.path.join(rerun, "image03.csv"), skiprows=1).image_file.tolist() == [weird]
+
+        # a clean run removes the stale errors file
+        run_main([bids, guid_map, out])
+    assert not os.path.exists(errors_file)
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+import bids2nda
+from bids2nda.integrity import CorruptFileError, check_full, check_integrity, check_quick
+from bids2nda.testing import make_bids_dataset
+
+
+def truncate(path, n_bytes):
+    """replace hard link with a truncated copy"""
+    with open(path, "rb") as f:
+        data = f.read()
+    os.remove(path)
+    with open(path, "wb") as f:
+        f.write(data[:len(data) - n_bytes])
+
+
+def corrupt_crc(path):
+    """flip the stored CRC32, leaving sizes intact"""
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    data[-8] ^= 0xff
+    os.remove(path)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+@pytest.fixture
+def dataset(tmpdir):
+    bids = str(tmpdir / "bids")
+    guid_map = make_bids_dataset(bids, 2, 0, n_volumes=40)
+    return bids, guid_map
+
+
+def test_quick_and_full(dataset):
+    bids, _ = dataset
+    good = os.path.join(bids, "sub-0001/func/sub-0001_task-rest_bold.nii.gz")
+    short = os.path.join(bids, "sub-0002/func/sub-0002_task-rest_bold.nii.gz")
+    bad_crc = os.path.join(bids, "sub-0002/anat/sub-0002_T1w.nii.gz")
+    truncate(short, 30)
+    corrupt_crc(bad_crc)
+
+    assert check_quick(good) is None
+    assert "Truncated" in check_quick(short)
+    assert check_full(bad_crc) is not None
+    assert check_full(good) is None
+
+    assert short in check_integrity([good, short, bad_crc], "quick")
+    assert set(check_integrity([good, short, bad_crc], "full", jobs=2)) == {short, bad_crc}
+
+
+def test_run_reports_before_writing(dataset, tmpdir):
+    bids, guid_map = dataset
+    truncate(os.path.join(bids, "sub-0002/func/sub-0002_task-rest_bold.nii.gz"), 30)
+    out = str(tmpdir / "out")
+    args = bids2nda.parse_args([bids, guid_map, out, "--integrity", "quick"])
+    with pytest.raises(CorruptFileError):
+        bids2nda.run(args)
+    assert not os.path.exists(out)
+
+    args = bids2nda.parse_args([bids, guid_map, out, "--integrity", "quick", "--keep-going"])
+    failures = []
+    imgdf = bids2nda.run(args, failures)
+    assert imgdf.shape[0] == 3
+    assert [f for f, _ in failures] == [os.path.join(bids, "sub-0002/func/sub-0002_task-rest_bold.nii.gz")]
@@ -0,0 +1,52 @@
+"""
+Deterministic I/O budgets for run(). Counts, not timings, so regressions fail the same way every time.
+"""
+import pytest
+
+import bids2nda
+from bids2nda.testing import IOCounter, make_bids_dataset
+
+
+# per-scan work, counted with everything each function does through helpers (read_json, ...)
+PER_SCAN_STAGES = ("session_context", "get_metadata_for_nifti", "image03_row", "add")
+
+
+def counted_run(tmpdir, n_subjects, n_sessions=2, stages=None):
+    bids = str(tmpdir / f"bids{n_subjects}")
+    guid_map = make_bids_dataset(bids, n_subjects, n_sessions, tasks=("rest", "nback"))
+    args = bids2nda.parse_args([bids, guid_map, str(tmpdir / f"out{n_subjects}")])
+    with IOCounter(stages) as io_count:
+        imgdf = bids2nda.run(args)
+    return imgdf.shape[0], io_count
+
+
+@pytest.mark.parametrize("n_sessions", [0, 2])
+def test_each_input_read_once(tmpdir, n_sessions):
+    n_scans, io_count = counted_run(tmpdir, 3, n_sessions)
+    assert n_scans == 3 * max(n_sessions, 1) * 3
+    # scan and inherited (top level task-*_bold.json) sidecars
+    assert io_count.max_per_file("open", ".json") == 1
+    assert io_count.max_per_file("json.load") == 1
+    # tsv lookups: once per session, not once per scan
+    assert io_count.max_per_file("open", "_scans.tsv") == 1
+    assert io_count.max_per_file("open", "participants.tsv") == 1
+
+
+def test_per_scan_budget_constant(tmpdir):
+    """stats/exists/opens grow linearly with scans and globs do not grow at all"""
+    small_n, small = counted_run(tmpdir, 2, stages=PER_SCAN_STAGES)
+    large_n, large = counted_run(tmpdir, 8, stages=PER_SCAN_STAGES)
+    for op, budget in [("exists", 6), ("stat", 3), ("open", 6)]:
+        assert large.total(op) <= budget * large_n, op
+    # own sidecar for every scan + each inherited task json once
+    assert large.total("json.load") == large_n + 2
+    assert large.total("glob") == small.total("glob")
+    # the metadata stage does O(1) work per scan: own sidecar + session/subject level candidates
+    per_scan = {op: large.by_stage["get_metadata_for_nifti"][op] / large_n for op in ["exists", "json.load"]}
+    assert 0 < per_scan["exists"] <= 3
+    assert 1 <= per_scan["json.load"] <= 1.2
+    # and per-scan counts do not change with 4x the scans (only one-off inherited sidecars differ)
+    for stage in PER_SCAN_STAGES:
+        assert large.by_stage[stage], stage
+        for op, count in large.by_stage[stage].items():
+            assert count / large_n == pytest.approx(small.by_stage[stage][op] / small_n, rel=0.15), (stage, op)
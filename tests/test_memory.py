@@ -0,0 +1,51 @@
+"""
+Memory budgets on synthetic datasets: the python peak must stay small as scans grow 10x.
+"""
+import json
+import os
+
+import bids2nda
+from bids2nda.memory import MemoryTracker
+from bids2nda.progress import Progress
+from bids2nda.testing import make_bids_dataset
+
+BUDGET_MB = 16
+PER_SCAN_KB = 50
+
+
+def traced_run(tmpdir, n_subjects):
+    bids = str(tmpdir / f"bids{n_subjects}")
+    guid_map = make_bids_dataset(bids, n_subjects, 2, tasks=("rest", "nback"))
+    out = str(tmpdir / f"out{n_subjects}")
+    imgdf = bids2nda.run(bids2nda.parse_args([bids, guid_map, out, "--memory-budget", str(BUDGET_MB)]))
+    with open(os.path.join(out, "image03_memory.json")) as f:
+        return imgdf.shape[0], json.load(f)
+
+
+def test_peak_within_budget_as_scans_grow(tmpdir):
+    small_n, small = traced_run(tmpdir, 3)
+    large_n, large = traced_run(tmpdir, 30)
+    assert large_n == 10 * small_n
+    assert {"participants", "discover", "convert", "dataframe"} <= set(large["stages"])
+    assert large["peak_traced_mb"] < BUDGET_MB
+    growth_kb = (large["peak_traced_mb"] - small["peak_traced_mb"]) * 1024 / (large_n - small_n)
+    assert growth_kb < PER_SCAN_KB
+
+
+def test_stage_and_block_windows():
+    memory = MemoryTracker(block=10)
+    progress = Progress(total=25, interval=1e9, memory=memory)
+    with memory:
+        progress.set_stage("small")
+        progress.update(5)
+        progress.set_stage("big")
+        held = []
+        for _ in range(20):
+            held.append(bytearray(256 * 1024))
+            progress.update()
+        del held
+    assert list(memory.stages) == ["small", "big"]
+    assert memory.stages["big"]["traced_peak_mb"] >= 5 > memory.stages["small"]["traced_peak_mb"]
+    assert [b["scans"] for b in memory.blocks] == [10, 20]
+    assert memory.blocks[1]["traced_peak_mb"] > memory.blocks[0]["traced_peak_mb"]
+    assert memory.over_budget is False
@@ -0,0 +1,36 @@
+import os
+import zipfile
+
+import bids2nda
+from bids2nda.metadata_zip import metadata_zip_path
+from bids2nda.testing import make_bids_dataset
+
+
+def test_zip_paths():
+    f = "bids/sub-1/ses-2/func/sub-1_ses-2_task-rest_run-1_bold.nii.gz"
+    assert metadata_zip_path("out", f) == "out/sub-1_ses-2_task-rest_run-1_bold.metadata.zip"
+    assert metadata_zip_path("out", f, per_session=True) == "out/sub-1_ses-2.metadata.zip"
+    assert metadata_zip_path("out", f, per_session=True, shard=True) == "out/sub-1/sub-1_ses-2.metadata.zip"
+    assert metadata_zip_path("out", "bids/sub-1/anat/sub-1_T1w.nii.gz", per_session=True) == "out/sub-1.metadata.zip"
+
+
+def test_session_zip(tmpdir):
+    bids = str(tmpdir / "bids")
+    guid_map = make_bids_dataset(bids, 2, 2, tasks=("rest", "nback"))
+    out = str(tmpdir / "out")
+    args = bids2nda.parse_args([bids, guid_map, out, "--session-zip", "--shard-output"])
+    imgdf = bids2nda.run(args)
+    assert imgdf.shape[0] == 12
+
+    zips = sorted(set(imgdf.data_file2))
+    assert len(zips) == 4  # 2 subjects x 2 sessions
+    assert sorted(d for d in os.listdir(out) if os.path.isdir(os.path.join(out, d))) == ["sub-0001", "sub-0002"]
+
+    session_zip = os.path.join(out, "sub-0001", "sub-0001_ses-1.metadata.zip")
+    with zipfile.ZipFile(session_zip) as zipf:
+        names = set(zipf.namelist())
+    assert names == {"sub-0001_ses-1_T1w.json",
+                     "sub-0001_ses-1_task-rest_bold.json",
+                     "sub-0001_ses-1_task-nback_bold.json"}
+    rows = imgdf[imgdf.data_file2 == session_zip]
+    assert rows.shape[0] == 3
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+import bids2nda
+from bids2nda.pipeline import Pipeline, Stage, StageError
+from bids2nda.testing import make_bids_dataset
+
+
+def test_fan_out_and_errors():
+    def split(n):
+        return [n * 10 + i for i in range(3)]
+
+    def check(n):
+        if n == 21:
+            raise ValueError("bad")
+        return [n]
+
+    pipeline = Pipeline([Stage("split", split), Stage("check", check, workers=3)])
+    results = list(pipeline.run(range(4)))
+    errors = [r for r in results if isinstance(r, StageError)]
+    assert sorted(r for r in results if not isinstance(r, StageError)) == \
+        [0, 1, 2, 10, 11, 12, 20, 22, 30, 31, 32]
+    assert [(e.stage, e.item) for e in errors] == [("check", 21)]
+    assert pipeline.stats()["check"]["items"] == 12
+
+
+def test_back_pressure():
+    """a slow last stage keeps at most queue_size items waiting in front of it"""
+    produced = []
+
+    def produce(n):
+        produced.append(n)
+        return [n]
+
+    def slow(n):
+        time.sleep(0.005)
+        return [n]
+
+    pipeline = Pipeline([Stage("produce", produce, queue_size=2), Stage("slow", slow, queue_size=2)],
+                        output_size=2)
+    for i, _ in enumerate(pipeline.run(range(50))):
+        # producer can only be a few queues ahead of the consumer
+        assert len(produced) <= i + 1 + 2 + 2 + 1 + 1
+    stats = pipeline.stats()
+    assert stats["slow"]["max_queue_depth"] <= 2
+    assert stats["slow"]["busy_seconds"] > stats["produce"]["busy_seconds"]
+
+
+def test_stop_early():
+    pipeline = Pipeline([Stage("id", lambda n: [n], workers=2)])
+    for n in pipeline.run(range(10_000)):
+        break
+    # run's cleanup joined every worker
+    assert not [t for t in threading.enumerate() if t.name.startswith("pipeline-")]
+
+
+def test_run_with_stage_workers(tmpdir):
+    bids = str(tmpdir / "bids")
+    guid_map = make_bids_dataset(bids, 4, 2, tasks=("rest", "nback"))
+    serial = bids2nda.run(bids2nda.parse_args([bids, guid_map, str(tmpdir / "serial")]))
+    parallel = bids2nda.run(bids2nda.parse_args(
+        [bids, guid_map, str(tmpdir / "parallel"), "--stage-workers", "header=3",
+         "--stage-workers", "zip=2", "--queue-size", "4"]))
+    assert serial.shape[0] == 24
+    assert list(parallel.image_file) == list(serial.image_file)
+    assert list(parallel.scan_type) == list(serial.scan_type)
+    assert all(p.replace("parallel", "serial") == s for p, s in zip(parallel.data_file2, serial.data_file2))
+
+
+def test_stage_workers_arg():
+    with pytest.raises(SystemExit):
+        bids2nda.parse_args(["b", "g", "o", "--stage-workers", "nosuchstage=2"])
+
+
+def test_queue_size_arg():
+    for value in ["0", "-1", "x"]:
+        with pytest.raises(SystemExit):
+            bids2nda.parse_args(["b", "g", "o", "--queue-size", value])
+    assert bids2nda.parse_args(["b", "g", "o", "--queue-size", "1"]).queue_size == 1
+    with pytest.raises(ValueError):
+        Stage("read", lambda item: [item], queue_size=0)
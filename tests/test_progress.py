@@ -0,0 +1,54 @@
+import json
+import logging
+
+import bids2nda
+from bids2nda.progress import Progress, RepeatFilter, WarningTally, log, warn
+
+
+def test_tally_and_repeat_filter():
+    repeat = RepeatFilter(max_repeats=2)
+    passed = []
+    handler = logging.Handler()
+    handler.emit = passed.append
+    handler.addFilter(repeat)
+    log.addHandler(handler)
+    try:
+        with WarningTally(n_examples=3) as tally:
+            for i in range(10):
+                warn("no_flip_angle", f"f{i}.nii.gz", f"flip angle is not set for f{i}.nii.gz")
+            warn("unknown_units", "x.nii.gz", "xyzt unit type of x.nii.gz is Unknown")
+    finally:
+        log.removeHandler(handler)
+    assert tally.counts() == {"no_flip_angle": 10, "unknown_units": 1}
+    assert tally.categories["no_flip_angle"]["examples"] == ["f0.nii.gz", "f1.nii.gz", "f2.nii.gz"]
+    assert len(passed) == 3  # 2 flip angle + 1 units
+
+
+def test_progress_eta():
+    now = [0.0]
+    progress = Progress(total=100, interval=10, clock=lambda: now[0])
+    progress.stage = "convert"
+    now[0] = 5.0
+    progress.update(50)
+    assert progress.message() == "50/100 files 10.0 files/s ETA 00:00:05 [convert]"
+
+
+def test_progress_rate_from_begin_and_long_eta():
+    now = [0.0]
+    progress = Progress(total=0, interval=1e9, clock=lambda: now[0])
+    now[0] = 1000.0  # setup stages
+    progress.begin(100_001, "convert")
+    now[0] = 1001.0
+    progress.update(1)
+    # 1 file/s from begin(), not 1/1001. over 24 hours does not wrap around
+    assert progress.message() == "1/100001 files 1.0 files/s ETA 27:46:40 [convert]"
+
+
+def test_run_writes_warnings(tmpdir):
+    args = bids2nda.parse_args(["examples/bids-noses/", "examples/guid_map.txt", str(tmpdir)])
+    bids2nda.run(args)
+    with open(tmpdir / "image03_warnings.json") as f:
+        warnings = json.load(f)
+    # example niftis have no flip angle and bold sidecars have no ExperimentID
+    assert warnings["no_flip_angle"]["count"] == 4
+    assert warnings["no_experiment_id"]["count"] == 2
@@ -0,0 +1,43 @@
+import logging
+import random
+
+import bids2nda
+from bids2nda.schedule import backward_steps, directory_switches, locality_order, schedule
+from bids2nda.testing import make_bids_dataset
+
+
+def test_locality_order_groups_directories(tmpdir):
+    bids = str(tmpdir / "bids")
+    make_bids_dataset(bids, 3, 2, tasks=("rest", "nback"))
+    files = bids2nda.find_niftis(bids)
+    random.Random(1).shuffle(files)
+    ordered = locality_order(files)
+    assert sorted(ordered) == sorted(files)
+    # one switch between consecutive directories: 3 subjects * 2 sessions * (anat, func)
+    assert directory_switches(ordered) == 3 * 2 * 2 - 1
+    assert directory_switches(files) > directory_switches(ordered)
+    assert backward_steps(ordered) == 0
+    assert list(schedule(files)) == [(s, e) for s in ["0001", "0002", "0003"] for e in ["1", "2"]]
+
+
+def test_backward_steps():
+    # test datasets hard link their niftis, so give the inodes explicitly
+    inodes = {"a/1": 10, "a/2": 20, "a/3": 30, "b/1": 5}
+    assert backward_steps(["a/1", "a/2", "a/3", "b/1"], inodes) == 0
+    assert backward_steps(["a/3", "a/1", "a/2", "b/1"], inodes) == 1
+    assert backward_steps(["a/2", "b/1", "a/1"], inodes) == 0  # different directories
+
+
+def test_rows_in_discovery_order(tmpdir, caplog):
+    bids = str(tmpdir / "bids")
+    guid_map = make_bids_dataset(bids, 3, 2)
+    dfs = {}
+    with caplog.at_level(logging.INFO, logger="bids2nda"):
+        for order in ["discovery", "locality"]:
+            args = bids2nda.parse_args([bids, guid_map, str(tmpdir / order), "--order", order])
+            dfs[order] = bids2nda.run(args)
+    assert list(dfs["locality"].image_file) == list(dfs["discovery"].image_file) == bids2nda.find_niftis(bids)
+    stats = {r.schedule_stats.order: r.schedule_stats for r in caplog.records if hasattr(r, "schedule_stats")}
+    assert stats["locality"].files == stats["discovery"].files == 12
+    assert stats["locality"].backward_steps == 0
+    assert "backward inode steps" in stats["locality"].message()
@@ -0,0 +1,79 @@
+import json
+import os
+import threading
+import urllib.request
+
+import pytest
+
+import bids2nda
+from bids2nda.server import ConversionService, make_server
+from bids2nda.testing import make_bids_dataset
+
+
+@pytest.fixture
+def served(tmpdir):
+    bids = str(tmpdir / "bids")
+    guid_map = make_bids_dataset(bids, 2, 2)
+    args = bids2nda.parse_args([bids, guid_map, str(tmpdir / "out")])
+    server = make_server(ConversionService(args), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield bids, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def request(url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    with urllib.request.urlopen(urllib.request.Request(url, data=data)) as resp:
+        return json.loads(resp.read())
+
+
+def test_rows_and_cache(served):
+    bids, url = served
+    resp = request(url + "/rows", {"sub": "0001", "ses": "1"})
+    assert resp["failures"] == []
+    assert [os.path.basename(r["image_file"]) for r in resp["rows"]] == \
+        ["sub-0001_ses-1_T1w.nii.gz", "sub-0001_ses-1_task-rest_bold.nii.gz"]
+    assert os.path.exists(resp["rows"][0]["data_file2"])
+
+    # same session again is served from the session cache
+    files = [r["image_file"] for r in resp["rows"]]
+    request(url + "/rows", {"files": files + [os.path.join(bids, "sub-0001/anat/missing_T1w.nii.gz")]})
+    stats = request(url + "/stats")
+    assert stats["requests"] == 2
+    assert stats["sessions"]["cached"] == 1
+    assert stats["sessions"]["hits"] >= 2
+    assert stats["sidecars"]["hits"] >= 1
+    assert stats["latency_seconds"]["max"] > 0
+
+    request(url + "/invalidate", {})
+    stats = request(url + "/stats")
+    assert stats["sessions"]["cached"] == 0
+    assert not stats["participants_loaded"]
+
+
+def test_bad_request(served):
+    _, url = served
+    with pytest.raises(urllib.error.HTTPError) as err:
+        request(url + "/rows", {"nothing": 1})
+    assert err.value.code == 400
+
+
+def test_invalidate_session_reloads_participants_and_sidecars(served):
+    bids, url = served
+    before = request(url + "/rows", {"sub": "0001", "ses": "1"})["rows"]
+    assert before[0]["gender"] == "M"
+    participants = os.path.join(bids, "participants.tsv")
+    with open(participants) as f:
+        text = f.read()
+    with open(participants, "w") as f:
+        f.write(text.replace("sub-0001\tM", "sub-0001\tF"))
+    # inherited sidecar that was cached as missing
+    with open(os.path.join(bids, "sub-0001/ses-1/sub-0001_ses-1_task-rest_bold.json"), "w") as f:
+        json.dump({"ManufacturersModelName": "Prisma"}, f)
+
+    request(url + "/invalidate", {"sub": "0001", "ses": "1"})
+    after = request(url + "/rows", {"sub": "0001", "ses": "1"})["rows"]
+    assert after[0]["gender"] == "F"
+    assert after[1]["scanner_type_pd"] == "Prisma"
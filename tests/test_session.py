@@ -1,6 +1,9 @@
 import pandas as pd
 import bids2nda
-from bids2nda.session_info import sub_from_file, read_participant_info, read_scan_date
+from unittest.mock import patch
+
+import bids2nda.session_info
+from bids2nda.session_info import sub_from_file, read_participant_info, read_scan_date, group_by_session, ndar_date
 
 
 def test_sub_extract():
@@ -109,3 +112,27 @@ def test_run_noses(tmpdir):
     )
     imgdf = bids2nda.run(args)
     assert imgdf.shape[0] == 4
+
+
+def test_group_by_session():
+    files = ["bids/sub-a/anat/sub-a_T1w.nii.gz",
+             "bids/sub-a/ses-1/anat/sub-a_ses-1_T1w.nii.gz",
+             "bids/sub-a/ses-1/func/sub-a_ses-1_task-rest_bold.nii.gz",
+             "bids/sub-b/ses-1/anat/sub-b_ses-1_T1w.nii.gz"]
+    sessions = group_by_session(files)
+    assert list(sessions) == [("a", None), ("a", "1"), ("b", "1")]
+    assert len(sessions[("a", "1")]) == 2
+    assert ndar_date("2020-12-31T10:00:00") == "12/31/2020"
+
+
+def test_scans_read_once_per_session(tmpdir):
+    """scans.tsv is read once per session, not once per scan"""
+    args = bids2nda.parse_args(
+        ["examples/bids-ses/", "examples/guid_map.txt", str(tmpdir)]
+    )
+    real_read = bids2nda.session_info.read_scans_index
+    with patch.object(bids2nda.session_info, "read_scans_index", side_effect=real_read) as reader:
+        imgdf = bids2nda.run(args)
+    assert imgdf.shape[0] == 8
+    assert reader.call_count == 4  # 2 subjects x 2 sessions
+    assert set(imgdf.visit) == {"1", "2"}
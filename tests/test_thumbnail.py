@@ -0,0 +1,83 @@
+import os
+import struct
+import zlib
+
+import nibabel as nb
+import numpy as np
+import pytest
+
+import bids2nda
+from bids2nda.testing import make_bids_dataset
+from bids2nda.thumbnail import encode_png, middle_slice, write_thumbnail
+
+
+def decode_gray_png(png: bytes) -> np.ndarray:
+    """just enough of a decoder to check encode_png"""
+    assert png[:8] == b"\x89PNG\r\n\x1a\n"
+    pos, idat = 8, b""
+    while pos < len(png):
+        length, kind = struct.unpack(">I4s", png[pos:pos + 8])
+        data = png[pos + 8:pos + 8 + length]
+        assert struct.unpack(">I", png[pos + 8 + length:pos + 12 + length])[0] == zlib.crc32(kind + data)
+        if kind == b"IHDR":
+            width, height = struct.unpack(">II", data[:8])
+        elif kind == b"IDAT":
+            idat += data
+        pos += 12 + length
+    raw = np.frombuffer(zlib.decompress(idat), dtype=np.uint8).reshape(height, width + 1)
+    assert (raw[:, 0] == 0).all()
+    return raw[:, 1:]
+
+
+def test_encode_png_roundtrip():
+    gray = np.arange(12 * 7, dtype=np.uint8).reshape(7, 12)
+    assert (decode_gray_png(encode_png(gray)) == gray).all()
+
+
+def test_middle_slice_first_volume(tmpdir):
+    bids = str(tmpdir / "bids")
+    make_bids_dataset(bids, 1, 0, n_volumes=7)
+    bold = os.path.join(bids, "sub-0001/func/sub-0001_task-rest_bold.nii.gz")
+    assert middle_slice(bold).shape == (4, 4)
+
+    png = str(tmpdir / "out.png")
+    write_thumbnail(bold, png)
+    mtime = os.path.getmtime(png)
+    # up to date: not rewritten
+    write_thumbnail(bold, png)
+    assert os.path.getmtime(png) == mtime
+    assert decode_gray_png(open(png, "rb").read()).shape == (4, 4)
+
+
+def test_run_thumbnails(tmpdir):
+    bids = str(tmpdir / "bids")
+    guid_map = make_bids_dataset(bids, 1, 1)
+    args = bids2nda.parse_args([bids, guid_map, str(tmpdir / "out"), "--thumbnails"])
+    imgdf = bids2nda.run(args)
+    assert all(os.path.exists(f) for f in imgdf.image_thumbnail_file)
+    assert all(imgdf.image_thumbnail_file.str.endswith(".thumbnail.png"))
+
+
+def test_truncated_bold_keep_going(tmpdir):
+    bids = str(tmpdir / "bids")
+    guid_map = make_bids_dataset(bids, 1, 0, n_volumes=40)
+    bold = os.path.join(bids, "sub-0001/func/sub-0001_task-rest_bold.nii.gz")
+    os.remove(bold)  # a hard link to the shared template
+    data = np.random.default_rng(0).integers(0, 1000, (16, 16, 8, 40), dtype=np.int16)
+    nb.save(nb.Nifti1Image(data, np.eye(4)), bold)
+    with open(bold, "rb") as f:
+        partial = f.read(2000)  # header is readable, the middle slice is not
+    with open(bold, "wb") as f:
+        f.write(partial)
+
+    args = bids2nda.parse_args([bids, guid_map, str(tmpdir / "out"), "--thumbnails"])
+    with pytest.raises(EOFError):
+        bids2nda.run(args)
+
+    failures = []
+    args = bids2nda.parse_args([bids, guid_map, str(tmpdir / "out"), "--thumbnails", "--keep-going",
+                                "--jobs", "2"])
+    imgdf = bids2nda.run(args, failures)
+    assert [os.path.basename(f) for f in imgdf.image_file] == ["sub-0001_T1w.nii.gz"]
+    assert [(f, type(err)) for f, err in failures] == [(bold, EOFError)]
+    assert os.path.exists(tmpdir / "out/image03_errors.tsv")